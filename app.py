@@ -1,135 +1,293 @@
-import numpy as np
+import hashlib
+from collections import OrderedDict
+
 import pandas as pd
 import streamlit as st
-import pgeocode
+
+from nearby_postcodes import (
+    CoverageCurve,
+    IncrementalNeighbours,
+    find_nearest_cached,
+    find_neighbours_cached,
+    find_neighbours_pgeocode,
+    find_postcodes_in_polygons,
+    find_postcodes_near_route,
+    flatten_neighbour_list,
+    flatten_rings,
+    get_radius_cache,
+    parse_breakpoints,
+    parse_postcodes,
+    parse_sites,
+    parse_waypoints,
+    ring_labels,
+)
 
 st.set_page_config(page_title="Nearby Postcodes Finder (AU)", page_icon="📍", layout="wide")
 
-# ---------------- Data ----------------
-@st.cache_data
-def load_postcodes_au():
-    # pgeocode bundles AU postcodes with centroids
-    nomi = pgeocode.Nominatim("AU")
-    df = nomi._data[["postal_code", "latitude", "longitude"]].dropna().copy()
-    df["postal_code"] = df["postal_code"].astype(str).str.strip().str.zfill(4)
-    df = df[(df["latitude"].notna()) & (df["longitude"].notna())]
-    df = df.reset_index(drop=True)
-    return df
-
-@st.cache_data
-def get_geodist():
-    return pgeocode.GeoDistance("AU")
-
-def parse_postcodes(text: str):
-    if not text:
-        return []
-    tokens = text.replace("\n", ",").split(",")
-    out = []
-    for t in tokens:
-        s = "".join(ch for ch in t.strip() if ch.isdigit())
-        if s:
-            out.append(s.zfill(4))
-    return out
+# How load_postcodes_au represents a postcode that spans several localities
+CENTROID_MODES = {
+    "mean": "Mean of localities",
+    "medoid": "Medoid locality",
+    "any": "Nearest locality",
+}
 
-def find_neighbours_pgeocode(df, inputs, radius_km):
-    all_codes = df["postal_code"].tolist()
-    code_set = set(all_codes)
-    geodist = get_geodist()
-
-    results_map = {}
-    missing = []
-
-    unique_inputs = list(dict.fromkeys(inputs))
-    for p in unique_inputs:
-        if p not in code_set:
-            results_map[p] = []
-            missing.append(p)
-            continue
-        dists = geodist.query_postal_code(p, all_codes)  # numpy array (km)
-        neighbours = [c for c, d in zip(all_codes, dists) if (not np.isnan(d)) and d <= radius_km]
-        results_map[p] = sorted(set(neighbours))
-
-    rows = []
-    for p in inputs:
-        ns = results_map.get(p, [])
-        rows.append({"input_postcode": p, "neighbours": ";".join(ns)})
-    return pd.DataFrame(rows), sorted(set(missing))
-
-def flatten_neighbour_list(results_df, dedupe=True, sort=True):
-    items = []
-    for s in results_df["neighbours"]:
-        if isinstance(s, str) and s:
-            items.extend([x for x in s.split(";") if x])
-
-    if dedupe:
-        items = list(set(items))
-
-    if sort:
-        items = sorted(items)
-
-    # IMPORTANT: include a space after each comma in the output string
-    csv_str = ", ".join(items)
-    return items, csv_str
+SEARCH_MODES = {
+    "radius": "Within radius",
+    "nearest": "Nearest postcodes",
+    "rings": "Distance rings",
+    "polygons": "Inside polygons",
+    "route": "Along a route",
+}
 
 # ---------------- UI ----------------
 st.title("📍 Nearby Postcodes Finder (AU)")
-st.write("Paste comma-separated postcodes, set a radius (km). Output is a single comma-separated list of neighbouring postcodes.")
-
-df_postcodes = load_postcodes_au()
-st.caption(f"Loaded {len(df_postcodes):,} AU postcodes.")
+st.write("Paste comma-separated postcodes and set a radius (km) or a number of nearest postcodes, or upload GeoJSON polygons, or list a route's waypoints. Output is a single comma-separated list of neighbouring postcodes.")
 
 col1, col2 = st.columns([3, 1])
-with col1:
-    text = st.text_area(
-        "Postcodes",
-        placeholder="2010, 5159, 4814, 6330, 4035, ...",
-        height=150,
-    )
 with col2:
-    radius = st.number_input(
-        "Radius (km)",
-        min_value=1.0,
-        max_value=1000.0,
-        value=15.0,
-        step=1.0
+    mode = st.radio("Find", options=list(SEARCH_MODES), format_func=SEARCH_MODES.get, horizontal=True)
+    if mode == "nearest":
+        k = st.number_input("Nearest postcodes", min_value=1, max_value=1000, value=20, step=1,
+                            help="Per input postcode, counting the postcode itself.")
+        capped = st.checkbox("Only within the radius")
+    if mode == "rings":
+        rings_text = st.text_input("Ring breakpoints (km)", value="5, 10, 25, 50",
+                                   help="Outer edge of each ring; 5, 10 gives rings 0-5 and 5-10 km.")
+    elif mode != "polygons":
+        radius = st.number_input(
+            "Distance from route (km)" if mode == "route" else "Radius (km)",
+            min_value=1.0,
+            max_value=1000.0,
+            value=15.0,
+            step=1.0
+        )
+    centroid = st.selectbox(
+        "Postcode location",
+        options=list(CENTROID_MODES),
+        format_func=CENTROID_MODES.get,
+        help="Postcodes spanning several localities: use their mean point, their most central "
+             "locality, or measure to whichever locality is nearest.",
     )
+with col1:
+    sites_file = polygons_file = None
+    if mode == "polygons":
+        polygons_file = st.file_uploader(
+            "Catchment polygons (GeoJSON)",
+            type=["geojson", "json"],
+            help="Polygon or MultiPolygon features; a postcode is listed when its location lies inside one.",
+        )
+    elif mode == "route":
+        text = st.text_area(
+            "Route waypoints",
+            placeholder="2010\n-33.87, 151.21\n2250, 2261",
+            height=150,
+            help="In route order, one per line: postcodes, or a latitude, longitude pair. "
+                 "Consecutive waypoints are joined by great-circle legs.",
+        )
+    else:
+        text = st.text_area(
+            "Postcodes",
+            placeholder="2010, 5159, 4814, 6330, 4035, ...",
+            height=150,
+        )
+    if mode == "radius":
+        sites_file = st.file_uploader(
+            "Sites with their own radius (optional)",
+            type=["csv", "txt"],
+            help="One postcode,radius_km per line. Lines without a radius, and postcodes typed above, use the radius on the right.",
+        )
+
+# Shared by every session, so repeat postcodes and smaller radii skip the search
+index = get_radius_cache(centroid)
+st.caption(f"Loaded {len(index):,} AU postcodes.")
+
+# Live count as the radius changes: the curve is built once per input list and read without searching
+if mode in ("radius", "rings") and sites_file is None:
+    preview_inputs = tuple(parse_postcodes(text))
+    preview = st.session_state.get("preview")
+    if preview_inputs and (preview is None or preview[0] != (centroid, preview_inputs)):
+        preview = st.session_state["preview"] = ((centroid, preview_inputs), CoverageCurve(index, preview_inputs))
+    if preview_inputs:
+        curve = preview[1]
+        with col2:
+            if mode == "radius":
+                st.caption(f"Preview: {curve.count(radius):,} postcodes within {radius:g} km")
+            else:
+                try:
+                    breakpoints = parse_breakpoints(rings_text)
+                except ValueError:
+                    breakpoints = []
+                if breakpoints:
+                    counts = curve.counts(breakpoints)
+                    rings = zip(ring_labels(breakpoints), counts - [0, *counts[:-1]])
+                    st.caption("Preview: " + ", ".join(f"{n:,} in {label} km" for label, n in rings))
 
 run = st.button("Find neighbours")
 
-if run:
-    inputs = parse_postcodes(text)
-    if not inputs:
-        st.warning("Please enter at least one postcode.")
-        st.stop()
+# Results kept per session, so download clicks and other reruns don't recompute them
+MAX_STORED_RESULTS = 8
+
+def file_digest(uploaded):
+    return None if uploaded is None else hashlib.sha256(uploaded.getvalue()).hexdigest()
+
+def query_key():
+    """Everything the result depends on, normalised so equivalent input text shares a key."""
+    if mode == "polygons":
+        return (mode, centroid, file_digest(polygons_file))
+    if mode == "route":
+        return (mode, centroid, tuple(parse_waypoints(text)), radius)
+    inputs = tuple(parse_postcodes(text))
+    if mode == "nearest":
+        return (mode, centroid, inputs, int(k), radius if capped else None)
+    if mode == "rings":
+        try:
+            return (mode, centroid, inputs, tuple(parse_breakpoints(rings_text)))
+        except ValueError:
+            return (mode, centroid, inputs, rings_text)
+    return (mode, centroid, inputs, radius, file_digest(sites_file))
+
+def incremental_search(radius_km):
+    """The session's IncrementalNeighbours at radius_km, started afresh when the radius or centroid changes."""
+    search = st.session_state.get("incremental")
+    if search is None or search.index is not index or search.radius_km != radius_km:
+        search = st.session_state["incremental"] = IncrementalNeighbours(index, radius_km)
+    return search
 
-    results_df, missing = find_neighbours_pgeocode(df_postcodes, inputs, radius)
+def compute():
+    """Run the query for the current widgets; warns and stops the script on unusable input."""
+    breakpoints = None
+    if mode == "polygons":
+        if polygons_file is None:
+            st.warning("Please upload a GeoJSON file of polygons.")
+            st.stop()
+        try:
+            results = find_postcodes_in_polygons(index, polygons_file.getvalue().decode("utf-8-sig"))
+        except ValueError as exc:
+            st.warning(f"{polygons_file.name}: {exc}")
+            st.stop()
+        missing = []
+        file_stem = "postcodes_in_" + polygons_file.name.rsplit(".", 1)[0]
+        summary = f"Searched {len(results.inputs)} polygon(s)."
+    elif mode == "route":
+        waypoints = parse_waypoints(text)
+        if not waypoints:
+            st.warning("Please enter at least one waypoint.")
+            st.stop()
+        results, missing = find_postcodes_near_route(index, waypoints, radius)
+        file_stem = f"route_within_{int(radius)}km"
+        summary = f"Searched a route through {len(waypoints) - sum(w in missing for w in waypoints)} waypoint(s)."
+        # Skipped coordinate pairs come back as (lat, lon) tuples
+        missing = [m if isinstance(m, str) else f"{m[0]:g}, {m[1]:g} (latitude/longitude out of range)" for m in missing]
+    else:
+        inputs = parse_postcodes(text)
+        radii = None
+        if sites_file is not None:
+            try:
+                site_inputs, site_radii = parse_sites(sites_file.getvalue().decode("utf-8-sig").splitlines(), radius)
+            except ValueError as exc:
+                st.warning(f"{sites_file.name}: {exc}")
+                st.stop()
+            radii = [radius] * len(inputs) + site_radii
+            inputs = inputs + site_inputs
+        if not inputs:
+            st.warning("Please enter at least one postcode.")
+            st.stop()
 
-    # Flatten to a single comma-and-space separated list from the neighbours column
-    neighbours_list, neighbours_csv = flatten_neighbour_list(results_df, dedupe=True, sort=True)
+        if mode == "rings":
+            try:
+                breakpoints = parse_breakpoints(rings_text)
+            except ValueError as exc:
+                st.warning(str(exc))
+                st.stop()
+            if not breakpoints:
+                st.warning("Please enter at least one ring breakpoint.")
+                st.stop()
+            # One search out to the outer ring; rings are cut from its distances
+            results, missing = find_neighbours_cached(index, inputs, breakpoints[-1],
+                                                      incremental=incremental_search(breakpoints[-1]))
+            file_stem = "neighbours_rings_" + "_".join(f"{b:g}" for b in breakpoints) + "km"
+        elif mode == "nearest":
+            results, missing = find_nearest_cached(index, inputs, int(k), radius if capped else None)
+            file_stem = f"nearest_{int(k)}" + (f"_within_{int(radius)}km" if capped else "")
+        elif radii is not None:
+            # Sites sharing a radius are searched together
+            results, missing = find_neighbours_pgeocode(index, inputs, radii)
+            file_stem = "neighbours_per_site_radius"
+        else:
+            # Shared with every other session asking for the same postcodes and radius; after an
+            # edit to the list, only the postcodes added since this session's last run are searched
+            results, missing = find_neighbours_cached(index, inputs, radius, incremental=incremental_search(radius))
+            file_stem = f"neighbours_within_{int(radius)}km"
+        summary = f"Computed neighbours for {len(set(inputs)) - len(missing)} postcode(s)."
 
-    computed = len(set(inputs)) - len(missing)
-    st.success(f"Computed neighbours for {computed} postcode(s). Total neighbours in list: {len(neighbours_list)}.")
-    if missing:
-        st.warning("Not found in dataset: " + ", ".join(missing))
+    # Flatten to a single comma-and-space separated list (union of every input's neighbours)
+    neighbours_list, neighbours_csv = flatten_neighbour_list(results, dedupe=True, sort=True)
+    out = {
+        "summary": summary,
+        "missing": missing,
+        "missing_text": ("Skipped waypoints: " + "; ".join(missing)) if mode == "route"
+                        else "Not found in dataset: " + ", ".join(missing),
+        "file_stem": file_stem,
+        "neighbours_list": neighbours_list,
+        "neighbours_csv": neighbours_csv,
+        "csv_bytes": pd.DataFrame({"postcode": neighbours_list}).to_csv(index=False).encode("utf-8"),
+    }
+    if breakpoints is not None:
+        out["rings"] = list(zip(ring_labels(breakpoints), flatten_rings(results, breakpoints)))
+        out["long_csv_bytes"] = results.to_long_frame(breakpoints).to_csv(index=False).encode("utf-8")
+    return out
+
+key = query_key()
+stored = st.session_state.setdefault("results", OrderedDict())
+if run and key not in stored:
+    stored[key] = compute()
+    while len(stored) > MAX_STORED_RESULTS:
+        stored.popitem(last=False)
+shown = stored.get(key)
+
+if shown is not None:
+    stored.move_to_end(key)
+    file_stem = shown["file_stem"]
+    st.success(f"{shown['summary']} Total neighbours in list: {len(shown['neighbours_list'])}.")
+    if shown["missing"]:
+        st.warning(shown["missing_text"])
 
     # Display the comma + space separated list
-    st.text_area("Comma-separated neighbours", neighbours_csv, height=150)
+    st.text_area("Comma-separated neighbours", shown["neighbours_csv"], height=150)
 
     # Download as TXT (comma + space separated)
     st.download_button(
         label="Download neighbours (TXT)",
-        data=neighbours_csv.encode("utf-8"),
-        file_name=f"neighbours_within_{int(radius)}km.txt",
+        data=shown["neighbours_csv"].encode("utf-8"),
+        file_name=f"{file_stem}.txt",
         mime="text/plain",
     )
 
     # Download as CSV (single column)
-    csv_df = pd.DataFrame({"postcode": neighbours_list})
     st.download_button(
         label="Download neighbours (CSV)",
-        data=csv_df.to_csv(index=False).encode("utf-8"),
-        file_name=f"neighbours_within_{int(radius)}km.csv",
+        data=shown["csv_bytes"],
+        file_name=f"{file_stem}.csv",
         mime="text/csv",
     )
 
+    if "rings" in shown:
+        # Each postcode is listed under the innermost ring it falls in for any input
+        for label, (ring_list, ring_csv) in shown["rings"]:
+            with st.expander(f"{label} km: {len(ring_list)} postcode(s)"):
+                st.text_area(f"Comma-separated neighbours, {label} km", ring_csv, height=100)
+                st.download_button(
+                    label=f"Download {label} km (TXT)",
+                    data=ring_csv.encode("utf-8"),
+                    file_name=f"neighbours_ring_{label}km.txt",
+                    mime="text/plain",
+                )
+
+        # Long format: one row per input and neighbour, with its distance and ring
+        st.download_button(
+            label="Download rings per input (long CSV)",
+            data=shown["long_csv_bytes"],
+            file_name=f"{file_stem}_long.csv",
+            mime="text/csv",
+        )
 
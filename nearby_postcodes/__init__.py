@@ -0,0 +1,59 @@
+"""Nearby AU postcode search, usable without the Streamlit app.
+
+    from nearby_postcodes import get_index, parse_postcodes, find_neighbours_pgeocode, flatten_neighbour_list
+
+    index = get_index()
+    results, missing = find_neighbours_pgeocode(index, parse_postcodes("2010, 5159"), 15)
+    postcodes, text = flatten_neighbour_list(results)
+
+Submodules are imported on first attribute access, so importing the package is cheap.
+"""
+import importlib
+
+_EXPORTS = {
+    "load_postcodes_au": "core",
+    "get_index": "core",
+    "parse_postcodes": "core",
+    "parse_sites": "core",
+    "parse_waypoints": "core",
+    "find_neighbours_pgeocode": "core",
+    "find_nearest_pgeocode": "core",
+    "find_postcodes_near_coords": "core",
+    "find_postcodes_in_polygons": "core",
+    "find_postcodes_near_route": "core",
+    "flatten_neighbour_list": "core",
+    "flatten_rings": "core",
+    "parse_breakpoints": "core",
+    "ring_labels": "core",
+    "NeighbourResult": "core",
+    "PointResult": "core",
+    "CoverageCurve": "core",
+    "ParallelSearch": "parallel",
+    "RadiusCache": "cache",
+    "get_radius_cache": "cache",
+    "ResultCache": "cache",
+    "get_result_cache": "cache",
+    "find_neighbours_cached": "cache",
+    "find_nearest_cached": "cache",
+    "IncrementalNeighbours": "cache",
+    "DiskCache": "store",
+    "get_disk_cache": "store",
+    "PostcodeIndex": "index",
+    "NeighbourGraph": "index",
+    "encode_postcodes": "index",
+    "format_postcodes": "index",
+    "haversine": "index",
+    "EARTH_RADIUS_KM": "index",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
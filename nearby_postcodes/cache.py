@@ -0,0 +1,352 @@
+"""Process-wide caches in front of the index.
+
+RadiusCache is a radius-aware LRU of per-postcode neighbour lists: each entry holds
+one postcode's neighbours sorted by distance, out to the radius they were computed
+at, so any query at or below that radius is a binary-search cut of the cached list.
+It stands in for the index it wraps, so find_neighbours_pgeocode(cache, ...) works
+unchanged.
+
+ResultCache holds whole query results, shared by every session and keyed by the
+canonical input set, so pasting the same postcodes in another order, or at the same
+moment as someone else, costs one search.
+
+IncrementalNeighbours follows one input list as it is edited, searching only the
+postcodes added since its last update.
+
+Both fall back to a DiskCache (see store.py) when given one, so their contents
+outlive the process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .core import NeighbourResult, _shared_resource, find_nearest_pgeocode, find_neighbours_pgeocode, get_index
+from .index import FLOAT32_TOLERANCE, NeighbourGraph, encode_postcodes
+from .store import get_disk_cache
+
+# Memory ceiling for cached neighbour lists; NEARBY_POSTCODES_CACHE_MB overrides the default
+DEFAULT_MAX_BYTES = int(float(os.environ.get("NEARBY_POSTCODES_CACHE_MB", "64")) * 1024 * 1024)
+# Rough per-entry bookkeeping (dict slot, tuple, array headers) on top of the array data
+ENTRY_OVERHEAD = 256
+# Whole-result cache limits; NEARBY_POSTCODES_RESULT_CACHE_MB and NEARBY_POSTCODES_RESULT_TTL_S override them
+DEFAULT_RESULT_MAX_BYTES = int(float(os.environ.get("NEARBY_POSTCODES_RESULT_CACHE_MB", "256")) * 1024 * 1024)
+DEFAULT_RESULT_MAX_AGE_S = float(os.environ.get("NEARBY_POSTCODES_RESULT_TTL_S", "3600"))
+
+class RadiusCache:
+    """Bounded LRU in front of an index (or ParallelSearch), keyed by postcode row."""
+
+    def __init__(self, index, max_bytes=DEFAULT_MAX_BYTES, store=None):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.store = store  # optional DiskCache consulted on a miss and filled with what is computed
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # row -> (radius_km, neighbour rows, km), both sorted by distance
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # codes, lookup etc. come from the wrapped index
+        if name in ("index", "store"):
+            raise AttributeError(name)
+        return getattr(self.index, name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def radius_pairs(self, rows, radius_km):
+        """Same contract as PostcodeIndex.radius_pairs, computing only rows not cached at radius_km or more."""
+        rows = np.asarray(rows, dtype=np.intp)
+        entries = [None] * len(rows)
+        with self._lock:
+            for i, row in enumerate(rows.tolist()):
+                entry = self._entries.get(row)
+                if entry is not None and entry[0] >= radius_km:
+                    self._entries.move_to_end(row)
+                    entries[i] = entry
+            n_hits = sum(e is not None for e in entries)
+            self.hits += n_hits
+            self.misses += len(rows) - n_hits
+
+        todo = [i for i, e in enumerate(entries) if e is None]
+        if todo and self.store is not None:
+            stored = self.store.neighbours(rows[todo], radius_km)
+            loaded = [i for i in todo if int(rows[i]) in stored]
+            for i in loaded:
+                entries[i] = stored[int(rows[i])]
+            self._store([rows[i] for i in loaded], [entries[i] for i in loaded])
+            todo = [i for i in todo if entries[i] is None]
+        if todo:
+            src_pos, nbr_rows, dists = self.index.radius_pairs(rows[todo], radius_km)
+            fresh = NeighbourGraph.from_pairs(src_pos, nbr_rows.astype(np.uint16), dists, len(todo), radius_km)
+            for j, i in enumerate(todo):
+                a, b = fresh.indptr[j], fresh.indptr[j + 1]
+                entries[i] = (radius_km, fresh.indices[a:b].copy(), fresh.distances[a:b].copy())
+            self._store([rows[i] for i in todo], [entries[i] for i in todo])
+            if self.store is not None:
+                self.store.put_neighbours([rows[i] for i in todo], [entries[i] for i in todo])
+
+        if not entries:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+        # Cut each distance-sorted list at radius_km, then restore neighbour-row order. Lists filled
+        # from a float32 graph hold rounded distances, so those near the cut are settled in float64
+        nbr_parts, dist_parts = [], []
+        sure, lengths = np.empty(len(rows), dtype=np.intp), np.empty(len(rows), dtype=np.intp)
+        for i, (_, nbrs, ds) in enumerate(entries):
+            sure[i] = np.searchsorted(ds, radius_km * (1 - FLOAT32_TOLERANCE), side="right")
+            lengths[i] = np.searchsorted(ds, radius_km * (1 + FLOAT32_TOLERANCE), side="right")
+            nbr_parts.append(nbrs[:lengths[i]])
+            dist_parts.append(ds[:lengths[i]])
+        src_pos = np.repeat(np.arange(len(rows)), lengths)
+        nbr_rows = np.concatenate(nbr_parts).astype(np.intp)
+        dists = np.concatenate(dist_parts).astype(np.float64)
+        offset = np.arange(len(src_pos)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        near = offset >= np.repeat(sure, lengths)
+        if near.any():
+            dists[near] = self.index.pair_distances(rows[src_pos[near]], nbr_rows[near])
+            keep = dists <= radius_km
+            src_pos, nbr_rows, dists = src_pos[keep], nbr_rows[keep], dists[keep]
+        order = np.lexsort((nbr_rows, src_pos))
+        return src_pos[order], nbr_rows[order], dists[order]
+
+    def _store(self, rows, entries):
+        with self._lock:
+            for row, entry in zip(rows, entries):
+                size = entry[1].nbytes + entry[2].nbytes + ENTRY_OVERHEAD
+                old = self._entries.get(row)
+                if size > self.max_bytes or (old is not None and old[0] >= entry[0]):
+                    continue  # too big to cache, or another thread cached a wider radius meanwhile
+                if old is not None:
+                    del self._entries[row]
+                    self._bytes -= old[1].nbytes + old[2].nbytes + ENTRY_OVERHEAD
+                self._entries[row] = entry
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted[1].nbytes + evicted[2].nbytes + ENTRY_OVERHEAD
+                    self.evictions += 1
+
+def get_radius_cache(centroid="mean", max_bytes=DEFAULT_MAX_BYTES):
+    """The process-wide RadiusCache over get_index(centroid), backed by its disk cache unless that is off."""
+    return _shared_resource(
+        ("radius_cache", centroid), lambda: RadiusCache(get_index(centroid), max_bytes, get_disk_cache(centroid))
+    )
+
+def result_key(kind, inputs, params, dataset_version):
+    """Canonical hash of a query: its kind, the sorted distinct inputs, its parameters and the dataset it ran on."""
+    canonical = json.dumps([kind, sorted(set(inputs)), params, dataset_version], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class _Flight:
+    # One computation in progress; concurrent callers of the same key wait on it
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResultCache:
+    """Shared LRU of whole results, bounded by total size and entry age, computing each key once at a time."""
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_MAX_BYTES, max_age_s=DEFAULT_RESULT_MAX_AGE_S):
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (stored at, size, value)
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_or_compute(self, key, compute, size_of):
+        """The cached value for key, else compute() once however many callers ask for it meanwhile."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.max_age_s:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._drop(key)
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if flight.error is None:
+                    self._store(key, flight.value, size_of(flight.value))
+            flight.done.set()
+        return flight.value
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic(), size, value)
+        self._bytes += size
+        # Least recently used first; expired entries go when they reach that end, or when next read
+        now = time.monotonic()
+        while self._entries:
+            oldest_key, (stored_at, _, _) = next(iter(self._entries.items()))
+            if self._bytes <= self.max_bytes and now - stored_at <= self.max_age_s:
+                break
+            self._drop(oldest_key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+def get_result_cache():
+    """The process-wide ResultCache."""
+    return _shared_resource("result_cache", ResultCache)
+
+def _cached(kind, index, inputs, params, find, results):
+    results = results if results is not None else get_result_cache()
+    store = index.store if isinstance(index, RadiusCache) else None
+    unique = sorted(set(inputs))
+    key = result_key(kind, unique, params, index.fingerprint)
+
+    def compute():
+        # Memory miss: try the disk, else search and keep the answer there too
+        if store is not None:
+            found = store.result(key)
+            if found is not None:
+                arrays, info = found
+                canonical = NeighbourResult(index, info["inputs"], arrays["input_pos"], arrays["indptr"],
+                                            arrays["nbr_rows"], arrays["dists"])
+                return canonical, info["missing"]
+        canonical, missing = find(unique)
+        if store is not None:
+            arrays = {"input_pos": canonical.input_pos, "indptr": canonical.indptr,
+                      "nbr_rows": canonical.nbr_rows, "dists": canonical.dists}
+            store.put_result(key, arrays, {"inputs": list(canonical.inputs), "missing": list(missing)})
+        return canonical, missing
+
+    canonical, missing = results.get_or_compute(key, compute, lambda value: value[0].nbytes())
+    return canonical.for_inputs(inputs), list(missing)
+
+def find_neighbours_cached(index, inputs, radius_km, results=None, incremental=None):
+    """find_neighbours_pgeocode (one radius) through the shared ResultCache.
+
+    With incremental (an IncrementalNeighbours over index at radius_km), a miss searches
+    only the postcodes it does not already hold.
+    """
+    if incremental is not None:
+        if incremental.index is not index or incremental.radius_km != radius_km:
+            raise ValueError("incremental search is for another index or radius")
+        find = incremental.update
+    else:
+        find = lambda unique: find_neighbours_pgeocode(index, unique, radius_km)
+    return _cached("radius", index, inputs, [float(radius_km)], find, results)
+
+class IncrementalNeighbours:
+    """Neighbours within one radius of an input list that is edited between searches.
+
+    Keeps each distinct input's neighbours and, per postcode, how many inputs reach it.
+    update() searches only the inputs added since the last call; removed inputs are
+    subtracted from the union by decrementing those counts instead of rebuilding it.
+    Not thread-safe: keep one per session.
+    """
+
+    def __init__(self, index, radius_km):
+        self.index = index
+        self.radius_km = radius_km
+        self.searched = 0  # distinct postcodes searched so far
+        self._lists = {}  # input row -> (neighbour rows, km), in neighbour-row order
+        self._refs = np.zeros(len(index), dtype=np.int32)  # inputs within radius_km of each postcode
+
+    def __len__(self):
+        return len(self._lists)
+
+    def update(self, inputs):
+        """Same (result, missing) as find_neighbours_pgeocode(index, inputs, radius_km), with the union from the counts."""
+        rows_idx = self.index.lookup(encode_postcodes(inputs))
+        missing = sorted({p for p, i in zip(inputs, rows_idx) if i < 0})
+        found_rows = np.unique(rows_idx[rows_idx >= 0])
+        wanted = set(found_rows.tolist())
+
+        for row in [r for r in self._lists if r not in wanted]:
+            nbrs, _ = self._lists.pop(row)
+            self._refs[nbrs] -= 1
+        added = np.array([r for r in found_rows.tolist() if r not in self._lists], dtype=np.intp)
+        if len(added):
+            src_pos, nbr_rows, dists = self.index.radius_pairs(added, self.radius_km)
+            bounds = np.searchsorted(src_pos, np.arange(len(added) + 1))
+            for j, row in enumerate(added.tolist()):
+                a, b = bounds[j], bounds[j + 1]
+                self._lists[row] = (nbr_rows[a:b], dists[a:b])
+                self._refs[nbr_rows[a:b]] += 1  # each neighbour appears once per input
+            self.searched += len(added)
+
+        pos_of_row = np.full(len(self.index), -1, dtype=np.intp)
+        pos_of_row[found_rows] = np.arange(len(found_rows))
+        input_pos = np.where(rows_idx >= 0, pos_of_row[rows_idx], -1)
+        lists = [self._lists[row] for row in found_rows.tolist()]
+        lengths = np.fromiter((len(n) for n, _ in lists), dtype=np.intp, count=len(lists))
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        nbr_rows = np.concatenate([n for n, _ in lists]) if lists else np.empty(0, dtype=np.intp)
+        dists = np.concatenate([d for _, d in lists]) if lists else np.empty(0)
+        result = NeighbourResult(self.index, inputs, input_pos, indptr, nbr_rows, dists, np.flatnonzero(self._refs))
+        return result, missing
+
+def find_nearest_cached(index, inputs, k, max_radius_km=None, results=None):
+    """find_nearest_pgeocode through the shared ResultCache."""
+    params = [int(k), None if max_radius_km is None else float(max_radius_km)]
+    return _cached("nearest", index, inputs, params, lambda unique: find_nearest_pgeocode(index, unique, k, max_radius_km), results)
@@ -0,0 +1,277 @@
+"""Streaming batch command line:
+
+    python -m nearby_postcodes --radius 15 postcodes.csv > neighbours.csv
+    cat postcodes.txt | python -m nearby_postcodes --radius 15 --output-format union
+    python -m nearby_postcodes --nearest 20 [--radius 50] postcodes.txt
+    python -m nearby_postcodes --sites [--radius 15] sites.csv    # postcode,radius_km lines
+    python -m nearby_postcodes --points --radius 15 stores.csv    # latitude,longitude columns
+
+Inputs are read and answered a chunk at a time, so memory stays bounded by the
+chunk size (plus one mask over the index for the union), whatever the input size.
+"""
+import argparse
+import csv
+import itertools
+import sys
+from contextlib import nullcontext
+
+import numpy as np
+
+from .cache import RadiusCache
+from .core import (
+    find_nearest_pgeocode,
+    find_neighbours_pgeocode,
+    find_postcodes_near_coords,
+    get_index,
+    parse_postcodes,
+    parse_sites,
+)
+from .index import format_postcodes
+from .parallel import ParallelSearch
+from .store import get_disk_cache
+
+DEFAULT_CHUNK_SIZE = 10_000
+# Missing postcodes reported on stderr; the count is always exact
+MAX_MISSING_EXAMPLES = 20
+# Header names recognised for --points coordinates, case-insensitively
+LAT_COLUMNS = ("latitude", "lat")
+LON_COLUMNS = ("longitude", "lon", "lng", "long")
+POINT_HEADER = ["point", "latitude", "longitude", "nearest_postcode", "nearest_km", "neighbours"]
+
+def iter_postcode_chunks(lines, input_format, column, chunk_size):
+    """Parsed postcodes from lines of TXT or CSV (with a header row), in lists of about chunk_size."""
+    if input_format == "csv":
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        if column is None:
+            col = 0
+        elif column in header:
+            col = header.index(column)
+        else:
+            raise ValueError(f"column {column!r} not in CSV header {header}")
+        tokens = (row[col] for row in reader if len(row) > col)
+    else:
+        tokens = lines
+
+    chunk = []
+    for token in tokens:
+        chunk.extend(parse_postcodes(token))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_site_chunks(lines, default_radius_km, chunk_size):
+    """(postcodes, radii) from "postcode,radius_km" lines (see parse_sites), about chunk_size lines at a time."""
+    lines = iter(lines)
+    first_line = 1
+    while True:
+        batch = list(itertools.islice(lines, chunk_size))
+        if not batch:
+            return
+        postcodes, radii = parse_sites(batch, default_radius_km, first_line)
+        first_line += len(batch)
+        if postcodes:
+            yield postcodes, radii
+
+def _find_column(header, name, candidates):
+    lowered = [h.strip().lower() for h in header]
+    for c in ([name.lower()] if name else candidates):
+        if c in lowered:
+            return lowered.index(c)
+    raise ValueError(f"no {name or ' / '.join(candidates)} column in CSV header {header}")
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+def iter_point_chunks(lines, column, lat_column, lon_column, chunk_size):
+    """(labels, latitudes, longitudes) from CSV lines with a header row, chunk_size points at a time.
+
+    Points are labelled by column, or by their 1-based data row when it is None.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    lat_col = _find_column(header, lat_column, LAT_COLUMNS)
+    lon_col = _find_column(header, lon_column, LON_COLUMNS)
+    label_col = None if column is None else _find_column(header, column, ())
+    labels, lats, lons = [], [], []
+    for n, row in enumerate(reader, 1):
+        if not any(f.strip() for f in row):
+            continue
+        labels.append(str(n) if label_col is None else (row[label_col] if len(row) > label_col else ""))
+        lats.append(_float(row[lat_col]) if len(row) > lat_col else np.nan)
+        lons.append(_float(row[lon_col]) if len(row) > lon_col else np.nan)
+        if len(labels) >= chunk_size:
+            yield labels, lats, lons
+            labels, lats, lons = [], [], []
+    if labels:
+        yield labels, lats, lons
+
+def _positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {text!r}")
+    return value
+
+def write_points(out, result):
+    # One row per point: its nearest postcode and its ";"-joined neighbours
+    result.to_frame().to_csv(out, header=False, index=False, lineterminator="\n")
+
+def write_long(out, result):
+    # One "input,neighbour,distance" line per pair, inputs in file order
+    pos, rows, dists = result.input_order_pairs()
+    inputs = result.inputs
+    codes = format_postcodes(result.index.codes[rows])
+    out.writelines(f"{inputs[i]},{c},{d:.3f}\n" for i, c, d in zip(pos.tolist(), codes, dists.tolist()))
+
+def run(lines, out, radius_km, centroid="mean", input_format="txt", column=None,
+        output_format="long", chunk_size=DEFAULT_CHUNK_SIZE, processes=1, nearest=None, sites=False):
+    """Stream neighbours of the postcodes in lines to out; returns (inputs read, missing count, missing examples).
+
+    With nearest, each input gets its nearest postcodes instead, and radius_km (if not None) caps their distance.
+    With sites, lines are "postcode,radius_km" pairs and radius_km is the default radius.
+    """
+    index = get_index(centroid)
+    if sites:
+        chunks = iter_site_chunks(lines, radius_km, chunk_size)
+    else:
+        chunks = ((chunk, radius_km) for chunk in iter_postcode_chunks(lines, input_format, column, chunk_size))
+    # Postcodes repeated across chunks, or seen by an earlier run, are answered from the caches
+    store = get_disk_cache(centroid)
+    if processes > 1:
+        with ParallelSearch(index, processes) as search:
+            return _run(chunks, out, RadiusCache(search, store=store), nearest, output_format)
+    return _run(chunks, out, RadiusCache(index, store=store), nearest, output_format)
+
+def _run(chunks, out, index, nearest, output_format):
+    union = np.zeros(len(index), dtype=bool)
+    n_inputs = n_missing = 0
+    missing_examples = []
+
+    if output_format == "long":
+        out.write("input_postcode,neighbour_postcode,distance_km\n")
+    for chunk, radius_km in chunks:
+        if nearest is None:
+            result, missing = find_neighbours_pgeocode(index, chunk, radius_km)
+        else:
+            result, missing = find_nearest_pgeocode(index, chunk, nearest, radius_km)
+        n_inputs += len(chunk)
+        n_missing += int((result.input_pos < 0).sum())
+        for p in missing:
+            if len(missing_examples) >= MAX_MISSING_EXAMPLES:
+                break
+            if p not in missing_examples:
+                missing_examples.append(p)
+        if output_format == "long":
+            write_long(out, result)
+        else:
+            union[result.nbr_rows] = True
+
+    if output_format == "union":
+        # Same text as flatten_neighbour_list: comma + space separated, sorted
+        out.write(", ".join(format_postcodes(index.codes[union])) + "\n")
+    return n_inputs, n_missing, missing_examples
+
+def run_points(lines, out, radius_km, centroid="mean", column=None, lat_column=None, lon_column=None,
+               output_format="long", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream postcodes near the lat/lon points of a CSV to out; returns (points read, unusable count, examples)."""
+    index = get_index(centroid)
+    union = np.zeros(len(index), dtype=bool)
+    n_points = n_missing = 0
+    missing_examples = []
+
+    if output_format == "long":
+        out.write(",".join(POINT_HEADER) + "\n")
+    for labels, lats, lons in iter_point_chunks(lines, column, lat_column, lon_column, chunk_size):
+        result, missing = find_postcodes_near_coords(index, lats, lons, radius_km, labels)
+        n_points += len(labels)
+        n_missing += len(missing)
+        missing_examples.extend(missing[:MAX_MISSING_EXAMPLES - len(missing_examples)])
+        if output_format == "long":
+            write_points(out, result)
+        else:
+            union[result.nbr_rows] = True
+
+    if output_format == "union":
+        out.write(", ".join(format_postcodes(index.codes[union])) + "\n")
+    return n_points, n_missing, missing_examples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m nearby_postcodes",
+        description="Find AU postcodes within a radius of (or nearest to) each input postcode, streaming large files.",
+    )
+    parser.add_argument("input", nargs="?", default="-", help="TXT or CSV file of postcodes, or - for stdin (default)")
+    parser.add_argument("-r", "--radius", type=float, help="radius in km; with --nearest, the furthest a neighbour may be")
+    parser.add_argument("-k", "--nearest", type=int, metavar="K",
+                        help="the K nearest postcodes to each input (itself included) instead of a radius")
+    parser.add_argument("--centroid", choices=("mean", "medoid", "any"), default="mean",
+                        help="location of postcodes with several localities (default: %(default)s)")
+    parser.add_argument("--sites", action="store_true",
+                        help="input lines are postcode,radius_km pairs; --radius is the default for lines without one")
+    parser.add_argument("--points", action="store_true",
+                        help="input is a CSV of latitude/longitude points; long output is one row per point")
+    parser.add_argument("--lat-column", help="--points latitude column (default: latitude or lat)")
+    parser.add_argument("--lon-column", help="--points longitude column (default: longitude, lon, lng or long)")
+    parser.add_argument("--input-format", choices=("auto", "txt", "csv"), default="auto",
+                        help="auto reads .csv files as CSV with a header row, anything else as TXT")
+    parser.add_argument("--column", help="CSV column holding the postcodes (default: the first), or with --points the point labels")
+    parser.add_argument("--output-format", choices=("long", "union"), default="long",
+                        help="long: input,neighbour,distance rows; union: one flattened list (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout (default)")
+    parser.add_argument("--chunk-size", type=_positive_int, default=DEFAULT_CHUNK_SIZE,
+                        help="input postcodes answered per batch (default: %(default)s)")
+    parser.add_argument("-j", "--processes", type=_positive_int, default=1,
+                        help="worker processes sharing each batch (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.sites and args.nearest is not None:
+        parser.error("--sites cannot be combined with --nearest")
+    if args.points and (args.sites or args.nearest is not None or args.radius is None):
+        parser.error("--points takes --radius, and not --sites or --nearest")
+    if args.radius is None and args.nearest is None and not args.sites:
+        parser.error("give --radius, --nearest or both")
+    if args.radius is not None and not args.radius > 0:
+        parser.error("--radius must be positive")
+    if args.nearest is not None and args.nearest < 1:
+        parser.error("--nearest must be at least 1")
+
+    input_format = args.input_format
+    if input_format == "auto":
+        input_format = "csv" if args.input.lower().endswith(".csv") else "txt"
+
+    source = nullcontext(sys.stdin) if args.input == "-" else open(args.input, newline="", encoding="utf-8-sig")
+    sink = nullcontext(sys.stdout) if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    with source as lines, sink as out:
+        try:
+            if args.points:
+                n_inputs, n_missing, examples = run_points(
+                    lines, out, args.radius, args.centroid, args.column, args.lat_column, args.lon_column,
+                    args.output_format, args.chunk_size,
+                )
+            else:
+                n_inputs, n_missing, examples = run(
+                    lines, out, args.radius, args.centroid, input_format, args.column,
+                    args.output_format, args.chunk_size, args.processes, args.nearest, args.sites,
+                )
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    if args.points:
+        print(f"{n_inputs:,} point(s), {n_missing:,} without usable coordinates", file=sys.stderr)
+        if examples:
+            print("Unusable coordinates: " + ", ".join(examples), file=sys.stderr)
+        return
+    print(f"{n_inputs:,} input postcode(s), {n_missing:,} not found", file=sys.stderr)
+    if examples:
+        print("Not found in dataset: " + ", ".join(examples), file=sys.stderr)
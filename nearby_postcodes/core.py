@@ -0,0 +1,376 @@
+"""Core API: load the dataset, parse inputs, find neighbours and flatten them.
+
+Nothing here imports Streamlit. Indexes are built once per process and shared
+read-only between threads.
+"""
+import threading
+
+import numpy as np
+
+from .index import PostcodeIndex, encode_postcodes, expand_ranges, format_postcodes, unit_vectors
+
+_shared = {}
+_shared_lock = threading.RLock()
+
+def _shared_resource(key, build):
+    # Built once per process under the lock, then read without it
+    try:
+        return _shared[key]
+    except KeyError:
+        pass
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = build()
+        return _shared[key]
+
+def load_postcodes_au(centroid="mean"):
+    """The AU postcode frame for centroid ("mean", "medoid" or "any"); shared, so treat it as read-only."""
+    from .dataset import collapse_localities, load_localities
+
+    # Bundled artefact (see dataset.py); pgeocode is only the fallback when it hasn't been built
+    return _shared_resource(("frame", centroid), lambda: collapse_localities(load_localities(), centroid))
+
+def get_index(centroid="mean"):
+    """The process-wide PostcodeIndex for centroid, with its neighbour graph attached when one has been built."""
+    def build():
+        from .graph import graph_path, load_graph
+
+        df = load_postcodes_au(centroid)
+        index = PostcodeIndex(df["postal_code"].to_numpy(), df["latitude"].to_numpy(), df["longitude"].to_numpy())
+        # Precomputed neighbours (see graph.py), memory-mapped so processes share the pages
+        index.graph = load_graph(graph_path(centroid), index)
+        return index
+
+    return _shared_resource(("index", centroid), build)
+
+def parse_postcodes(text: str):
+    if not text:
+        return []
+    tokens = text.replace("\n", ",").split(",")
+    out = []
+    for t in tokens:
+        s = "".join(ch for ch in t.strip() if ch.isdigit())
+        if s:
+            out.append(s.zfill(4))
+    return out
+
+def parse_sites(lines, default_radius_km=None, first_line=1):
+    """(postcodes, radii) from "postcode,radius_km" lines; lines without a radius get default_radius_km.
+
+    Lines whose first field holds no postcode (e.g. a header) are skipped.
+    """
+    postcodes, radii = [], []
+    for line_no, line in enumerate(lines, first_line):
+        fields = line.split(",")
+        found = parse_postcodes(fields[0])
+        if not found:
+            continue
+        radius_text = fields[1].strip() if len(fields) > 1 else ""
+        try:
+            radius_km = float(radius_text) if radius_text else default_radius_km
+        except ValueError:
+            raise ValueError(f"line {line_no}: not a radius: {radius_text!r}") from None
+        if radius_km is None:
+            raise ValueError(f"line {line_no}: no radius given and no default")
+        if not radius_km > 0:
+            raise ValueError(f"line {line_no}: radius must be positive")
+        postcodes.extend(found)
+        radii.extend([radius_km] * len(found))
+    return postcodes, radii
+
+def parse_waypoints(text):
+    """Route waypoints from text, one line each: postcodes (as parse_postcodes reads them) or "lat, lon".
+
+    A line is a coordinate pair when it has exactly two numbers and either has a sign or decimal point;
+    waypoints come back as postcode strings and (lat, lon) float tuples, in order.
+    """
+    waypoints = []
+    for line in (text or "").splitlines():
+        fields = [f.strip() for f in line.split(",") if f.strip()]
+        if len(fields) == 2 and any(c in line for c in ".-"):
+            try:
+                waypoints.append((float(fields[0]), float(fields[1])))
+                continue
+            except ValueError:
+                pass
+        waypoints.extend(parse_postcodes(line))
+    return waypoints
+
+def parse_breakpoints(text):
+    """Sorted distinct ring breakpoints (km) from text such as "5, 10, 25, 50"."""
+    values = set()
+    for t in text.replace("\n", ",").split(","):
+        t = t.strip()
+        if not t:
+            continue
+        try:
+            value = float(t)
+        except ValueError:
+            raise ValueError(f"not a distance: {t!r}") from None
+        if not value > 0:
+            raise ValueError(f"ring breakpoints must be positive: {t!r}")
+        values.add(value)
+    return sorted(values)
+
+def ring_index(dists, breakpoints):
+    """Ring of each distance: 0 up to breakpoints[0], i for (breakpoints[i-1], breakpoints[i]]."""
+    return np.digitize(dists, breakpoints, right=True)
+
+def ring_labels(breakpoints):
+    edges = [0.0, *breakpoints]
+    return [f"{a:g}-{b:g}" for a, b in zip(edges[:-1], edges[1:])]
+
+class NeighbourResult:
+    """Neighbours of each input as index rows; postcode text is only produced at output time."""
+
+    def __init__(self, index, inputs, input_pos, indptr, nbr_rows, dists, union=None):
+        self.index = index
+        self.inputs = inputs
+        self.input_pos = input_pos  # per input: position among the found unique inputs, -1 if missing
+        self.indptr = indptr
+        self.nbr_rows = nbr_rows
+        self.dists = dists
+        self.union = union  # sorted union rows when already known (see cache.IncrementalNeighbours)
+
+    def union_rows(self):
+        if self.union is not None:
+            return self.union
+        # OR every input's neighbour set into one mask over the index; rows come out sorted
+        mask = np.zeros(len(self.index), dtype=bool)
+        mask[self.nbr_rows] = True
+        return np.flatnonzero(mask)
+
+    def input_order_pairs(self):
+        """(position in inputs, neighbour row, km) for every input's neighbours, in input order, repeats included."""
+        found = np.flatnonzero(self.input_pos >= 0)
+        pos = self.input_pos[found]
+        starts = self.indptr[pos]
+        lengths = self.indptr[pos + 1] - starts
+        edges = expand_ranges(starts, lengths)
+        return np.repeat(found, lengths), self.nbr_rows[edges], self.dists[edges]
+
+    def for_inputs(self, inputs):
+        """This result seen through another order or repetition of its inputs (each must be one of self.inputs)."""
+        pos_of = dict(zip(self.inputs, self.input_pos.tolist()))
+        input_pos = np.fromiter((pos_of[p] for p in inputs), dtype=np.intp, count=len(inputs))
+        # The same distinct inputs reach the same union; a subset may reach fewer postcodes
+        union = self.union if len(set(inputs)) == len(pos_of) else None
+        return NeighbourResult(self.index, inputs, input_pos, self.indptr, self.nbr_rows, self.dists, union)
+
+    def nbytes(self):
+        # Arrays plus a rough allowance per input string
+        arrays = (self.input_pos, self.indptr, self.nbr_rows, self.dists)
+        union = 0 if self.union is None else self.union.nbytes
+        return sum(a.nbytes for a in arrays) + union + 64 * len(self.inputs)
+
+    def input_order_rows(self):
+        return self.input_order_pairs()[1]
+
+    def to_long_frame(self, breakpoints=None):
+        """One row per (input, neighbour) in input order, with the ring label when breakpoints are given."""
+        import pandas as pd
+
+        pos, rows, dists = self.input_order_pairs()
+        frame = pd.DataFrame({
+            "input_postcode": np.asarray(self.inputs, dtype=object)[pos],
+            "neighbour_postcode": format_postcodes(self.index.codes[rows]),
+            "distance_km": dists.round(3),
+        })
+        if breakpoints is not None:
+            frame["ring_km"] = np.asarray(ring_labels(breakpoints), dtype=object)[ring_index(dists, breakpoints)]
+        return frame
+
+    def to_frame(self):
+        import pandas as pd
+
+        codes = format_postcodes(self.index.codes)
+        rows = []
+        for p, pos in zip(self.inputs, self.input_pos):
+            ns = codes[self.nbr_rows[self.indptr[pos]:self.indptr[pos + 1]]] if pos >= 0 else []
+            rows.append({"input_postcode": p, "neighbours": ";".join(ns)})
+        # Explicit columns, so no inputs still gives a frame with the usual header
+        return pd.DataFrame(rows, columns=["input_postcode", "neighbours"])
+
+class PointResult(NeighbourResult):
+    """NeighbourResult for lat/lon points, whose inputs are point labels, plus each point's nearest postcode."""
+
+    def __init__(self, index, inputs, input_pos, indptr, nbr_rows, dists, lat_deg, lon_deg, nearest_rows, nearest_km):
+        super().__init__(index, inputs, input_pos, indptr, nbr_rows, dists)
+        self.lat_deg = lat_deg
+        self.lon_deg = lon_deg
+        self.nearest_rows = nearest_rows  # per point, -1 for unusable coordinates
+        self.nearest_km = nearest_km
+
+    def nearest_postcodes(self):
+        """Nearest postcode of each point, None for unusable coordinates."""
+        codes = format_postcodes(self.index.codes[np.maximum(self.nearest_rows, 0)])
+        return [c if row >= 0 else None for c, row in zip(codes, self.nearest_rows)]
+
+    def to_frame(self):
+        import pandas as pd
+
+        frame = super().to_frame().rename(columns={"input_postcode": "point"})
+        frame.insert(1, "latitude", self.lat_deg)
+        frame.insert(2, "longitude", self.lon_deg)
+        frame.insert(3, "nearest_postcode", self.nearest_postcodes())
+        frame.insert(4, "nearest_km", self.nearest_km.round(3))
+        return frame
+
+def find_postcodes_near_coords(index, lat_deg, lon_deg, radius_km, labels=None):
+    """Postcodes within radius_km of each lat/lon point, and the nearest postcode to each.
+
+    Returns (PointResult, labels of points with missing or out-of-range coordinates).
+    """
+    lat = np.asarray(lat_deg, dtype=np.float64)
+    lon = np.asarray(lon_deg, dtype=np.float64)
+    labels = list(range(len(lat))) if labels is None else list(labels)
+    with np.errstate(invalid="ignore"):
+        valid = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    missing = [labels[i] for i in np.flatnonzero(~valid)]
+    input_pos = np.full(len(lat), -1, dtype=np.intp)
+    input_pos[valid] = np.arange(int(valid.sum()))
+
+    src_pos, nbr_rows, dists = index.coord_radius_pairs(lat[valid], lon[valid], radius_km)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src_pos, minlength=int(valid.sum())))))
+    nearest_rows = np.full(len(lat), -1, dtype=np.intp)
+    nearest_km = np.full(len(lat), np.nan)
+    nearest_rows[valid], nearest_km[valid] = index.nearest_to_coords(lat[valid], lon[valid])
+    result = PointResult(index, labels, input_pos, indptr, nbr_rows, dists, lat, lon, nearest_rows, nearest_km)
+    return result, missing
+
+def find_postcodes_in_polygons(index, geojson):
+    """Postcodes inside each feature of a GeoJSON polygon layer, as a NeighbourResult over feature labels.
+
+    Every postcode found is inside, so its distance is 0 km.
+    """
+    from .polygons import parse_geojson
+
+    labels, shapes = parse_geojson(geojson)
+    per_feature = [index.polygon_rows(polygons) for polygons in shapes]
+    lengths = np.array([len(rows) for rows in per_feature], dtype=np.intp)
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    nbr_rows = np.concatenate(per_feature)
+    return NeighbourResult(index, labels, np.arange(len(labels)), indptr, nbr_rows, np.zeros(len(nbr_rows)))
+
+def find_postcodes_near_route(index, waypoints, buffer_km, label="route"):
+    """Postcodes within buffer_km of the great-circle polyline through waypoints (postcodes or (lat, lon) pairs).
+
+    Returns (NeighbourResult with the route as its one input, skipped waypoints): postcodes not in the
+    dataset, then (lat, lon) pairs out of range (such as a swapped pair); those are left out of the route.
+    """
+    codes = [w for w in waypoints if isinstance(w, str)]
+    rows_of_codes = index.lookup(encode_postcodes(codes)) if codes else np.empty(0, dtype=np.intp)
+    missing = sorted({p for p, i in zip(codes, rows_of_codes) if i < 0})
+    row_of = dict(zip(codes, rows_of_codes.tolist()))
+    # Same ranges as find_postcodes_near_coords; NaN fails both
+    bad = [w for w in waypoints if not isinstance(w, str) and not (abs(w[0]) <= 90 and abs(w[1]) <= 180)]
+    missing += list(dict.fromkeys(bad))
+    xyz = []
+    for w in waypoints:
+        if isinstance(w, str):
+            if row_of[w] >= 0:
+                xyz.append(index.row_unit_vectors([row_of[w]])[0])
+        elif w not in bad:
+            xyz.append(unit_vectors([w[0]], [w[1]])[2][0])
+
+    rows, km = index.route_rows(np.asarray(xyz).reshape(-1, 3), buffer_km)
+    indptr = np.array([0, len(rows)])
+    return NeighbourResult(index, [label], np.zeros(1, dtype=np.intp), indptr, rows, km), missing
+
+def find_neighbours_pgeocode(index, inputs, radius_km):
+    """Neighbours of each input within radius_km, which is either one radius or a radius per input."""
+    if np.ndim(radius_km) == 0:
+        return _find(index, inputs, lambda rows: index.radius_pairs(rows, radius_km))
+    return _find_per_radius(index, inputs, np.asarray(radius_km, dtype=np.float64))
+
+def find_nearest_pgeocode(index, inputs, k, max_radius_km=None):
+    """Like find_neighbours_pgeocode, but the k nearest postcodes to each input (itself included), optionally within max_radius_km."""
+    return _find(index, inputs, lambda rows: index.knn_pairs(rows, k, max_radius_km))
+
+def _find(index, inputs, query_pairs):
+    rows_idx = index.lookup(encode_postcodes(inputs))
+    missing = sorted({p for p, i in zip(inputs, rows_idx) if i < 0})
+    # Each distinct postcode is queried once
+    found_rows = np.unique(rows_idx[rows_idx >= 0])
+    pos_of_row = np.full(len(index), -1, dtype=np.intp)
+    pos_of_row[found_rows] = np.arange(len(found_rows))
+    input_pos = np.where(rows_idx >= 0, pos_of_row[rows_idx], -1)
+
+    # Pairs come back sorted by input then neighbour row, i.e. each input's neighbours in postcode order
+    src_pos, nbr_rows, dists = query_pairs(found_rows)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src_pos, minlength=len(found_rows)))))
+    return NeighbourResult(index, inputs, input_pos, indptr, nbr_rows, dists), missing
+
+def _find_per_radius(index, inputs, radii):
+    if len(radii) != len(inputs):
+        raise ValueError("give one radius per input")
+    rows_idx = index.lookup(encode_postcodes(inputs))
+    missing = sorted({p for p, i in zip(inputs, rows_idx) if i < 0})
+    # One query per distinct (radius, postcode), grouped by radius
+    found = rows_idx >= 0
+    queries, query_of_input = np.unique(np.column_stack((radii[found], rows_idx[found])), axis=0, return_inverse=True)
+    input_pos = np.full(len(inputs), -1, dtype=np.intp)
+    input_pos[found] = query_of_input.ravel()
+    q_radii, q_rows = queries[:, 0], queries[:, 1].astype(np.intp)
+    bounds = np.flatnonzero(np.diff(q_radii, prepend=np.nan, append=np.nan) != 0)
+
+    # Largest radius first, so a RadiusCache answers smaller radii of the same postcodes from it
+    parts = [None] * (len(bounds) - 1)
+    for g in reversed(range(len(parts))):
+        a, b = bounds[g], bounds[g + 1]
+        src_pos, nbr_rows, dists = index.radius_pairs(q_rows[a:b], q_radii[a])
+        parts[g] = (src_pos + a, nbr_rows, dists)
+    empty = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0))
+    src_pos, nbr_rows, dists = (np.concatenate(x) for x in zip(empty, *parts))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src_pos, minlength=len(q_rows)))))
+    return NeighbourResult(index, inputs, input_pos, indptr, nbr_rows, dists), missing
+
+class CoverageCurve:
+    """How many postcodes find_neighbours_pgeocode would list for fixed inputs, at any radius.
+
+    Holds every postcode's distance to its nearest input, sorted, so the size of the
+    neighbour union at a radius is one binary search; built once per input list, it
+    previews radius changes without searching.
+    """
+
+    def __init__(self, index, inputs):
+        rows_idx = index.lookup(encode_postcodes(inputs))
+        self.missing = sorted({p for p, i in zip(inputs, rows_idx) if i < 0})
+        self.rows = np.unique(rows_idx[rows_idx >= 0])
+        km = index.distance_to_nearest(self.rows)
+        self.km = np.sort(km[np.isfinite(km)])
+
+    def count(self, radius_km):
+        """Distinct postcodes within radius_km of any input."""
+        return int(np.searchsorted(self.km, radius_km, side="right"))
+
+    def counts(self, radii_km):
+        return np.searchsorted(self.km, np.asarray(radii_km, dtype=np.float64), side="right")
+
+def flatten_neighbour_list(results, dedupe=True, sort=True):
+    if dedupe:
+        rows = results.union_rows()
+    else:
+        rows = results.input_order_rows()
+        if sort:
+            rows = np.sort(rows, kind="stable")
+    # Index codes are sorted, so row order is postcode order
+    items = format_postcodes(results.index.codes[rows]).tolist()
+
+    # IMPORTANT: include a space after each comma in the output string
+    csv_str = ", ".join(items)
+    return items, csv_str
+
+def flatten_rings(results, breakpoints):
+    """flatten_neighbour_list output per ring, for results searched out to breakpoints[-1].
+
+    Each postcode goes in the innermost ring it reaches from any input, so the rings
+    partition the full list.
+    """
+    nearest_ring = np.full(len(results.index), len(breakpoints))
+    np.minimum.at(nearest_ring, results.nbr_rows, ring_index(results.dists, breakpoints))
+    out = []
+    for ring in range(len(breakpoints)):
+        items = format_postcodes(results.index.codes[nearest_ring == ring]).tolist()
+        out.append((items, ", ".join(items)))
+    return out
@@ -0,0 +1,132 @@
+"""Bundled AU postcode dataset.
+
+The app reads a cleaned copy of the GeoNames AU postcode table from a
+versioned NPZ artefact, so it starts without network access. Rebuild the
+artefact from pgeocode with:
+
+    python -m nearby_postcodes.dataset [--output PATH]
+"""
+import argparse
+import hashlib
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .index import haversine
+
+DATASET_PATH = Path(__file__).resolve().parent / "data" / "postcodes_au.npz"
+# Bump when the fields or their encoding change; older artefacts are then rejected
+DATASET_FORMAT = 2
+DATASET_FIELDS = ("postal_code", "latitude", "longitude", "locality", "state")
+
+def fetch_postcodes_pgeocode():
+    """Download (or reuse pgeocode's cache of) the AU table and clean it to DATASET_FIELDS."""
+    import pgeocode  # only needed to refresh the artefact
+
+    nomi = pgeocode.Nominatim("AU")
+    df = nomi._data[["postal_code", "latitude", "longitude", "place_name", "state_code"]]
+    df = df.dropna(subset=["postal_code", "latitude", "longitude"]).copy()
+    df = df.rename(columns={"place_name": "locality", "state_code": "state"})
+    # uint16 postcode IDs; anything that isn't a 4-digit number is dropped
+    df["postal_code"] = pd.to_numeric(df["postal_code"].astype(str).str.strip(), errors="coerce")
+    df = df[df["postal_code"].between(0, 9999)].astype({"postal_code": np.uint16})
+    df["locality"] = df["locality"].fillna("").astype(str)
+    df["state"] = df["state"].fillna("").astype(str)
+    return df[list(DATASET_FIELDS)].reset_index(drop=True)
+
+def to_arrays(df):
+    return {
+        "postal_code": df["postal_code"].to_numpy(dtype=np.uint16),
+        "latitude": df["latitude"].to_numpy(dtype=np.float64),
+        "longitude": df["longitude"].to_numpy(dtype=np.float64),
+        "locality": df["locality"].to_numpy(dtype=str),
+        "state": df["state"].to_numpy(dtype=str),
+    }
+
+def checksum_arrays(arrays):
+    """SHA-256 over the dataset columns: name, dtype, shape and raw bytes, in field order."""
+    h = hashlib.sha256()
+    for name in DATASET_FIELDS:
+        a = np.ascontiguousarray(arrays[name])
+        h.update(f"{name}:{a.dtype.str}:{a.shape}".encode("utf-8"))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+def write_dataset(df, path=DATASET_PATH):
+    """Write df to path as a compressed NPZ artefact and return its checksum."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = to_arrays(df)
+    checksum = checksum_arrays(arrays)
+    np.savez_compressed(
+        path,
+        format=np.array(DATASET_FORMAT),
+        checksum=np.array(checksum),
+        built_at=np.array(datetime.now(timezone.utc).isoformat(timespec="seconds")),
+        **arrays,
+    )
+    return checksum
+
+def read_dataset(path=DATASET_PATH):
+    """Load the artefact at path as (df, checksum), rejecting unknown formats and corrupt data."""
+    with np.load(path, allow_pickle=False) as npz:
+        fmt = int(npz["format"])
+        if fmt != DATASET_FORMAT:
+            raise ValueError(f"{path}: dataset format {fmt}, expected {DATASET_FORMAT}; rebuild it with python -m nearby_postcodes.dataset")
+        arrays = {name: npz[name] for name in DATASET_FIELDS}
+        checksum = str(npz["checksum"])
+    if checksum_arrays(arrays) != checksum:
+        raise ValueError(f"{path}: checksum mismatch; rebuild it with python -m nearby_postcodes.dataset")
+    return pd.DataFrame(arrays), checksum
+
+def load_localities(path=DATASET_PATH):
+    """One row per locality, from the artefact when it has been built, otherwise from pgeocode."""
+    if Path(path).exists():
+        df, _ = read_dataset(path)
+        return df
+    warnings.warn(f"{path} not found; downloading the postcode table with pgeocode. Rebuild it with python -m nearby_postcodes.dataset")
+    return fetch_postcodes_pgeocode()
+
+def medoid_localities(df):
+    # The locality with the smallest total distance to the other localities of its postcode
+    pts = pd.DataFrame({
+        "postal_code": df["postal_code"].to_numpy(),
+        "row": np.arange(len(df)),
+        "lat": np.radians(df["latitude"].to_numpy()),
+        "lon": np.radians(df["longitude"].to_numpy()),
+    })
+    pairs = pts.merge(pts, on="postal_code", suffixes=("", "_other"))
+    pairs["dist"] = haversine(pairs["lat"], pairs["lon"], pairs["lat_other"], pairs["lon_other"])
+    totals = pairs.groupby(["postal_code", "row"], sort=True)["dist"].sum().reset_index()
+    best = totals.loc[totals.groupby("postal_code", sort=True)["dist"].idxmin(), "row"]
+    return df.iloc[best.to_numpy()].reset_index(drop=True)
+
+def collapse_localities(df, centroid="mean"):
+    """One row per postcode ("mean" or "medoid" locality), or every locality unchanged ("any")."""
+    if centroid == "mean":
+        grouped = df.groupby("postal_code", sort=True)
+        out = grouped[["latitude", "longitude"]].mean()
+        out["locality"] = grouped["locality"].agg(", ".join)
+        out["state"] = grouped["state"].first()
+        return out.reset_index()
+    if centroid == "medoid":
+        return medoid_localities(df)
+    if centroid == "any":
+        return df
+    raise ValueError(f"Unknown centroid mode: {centroid!r}")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m nearby_postcodes.dataset", description="Rebuild the bundled AU postcode dataset from pgeocode.")
+    parser.add_argument("--output", default=str(DATASET_PATH), help="artefact path (default: %(default)s)")
+    args = parser.parse_args()
+
+    df = fetch_postcodes_pgeocode()
+    checksum = write_dataset(df, args.output)
+    print(f"Wrote {len(df):,} localities ({df['postal_code'].nunique():,} postcodes) to {args.output}")
+    print(f"sha256 {checksum}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Precomputed neighbour graph: every postcode's neighbours within a maximum radius.
+
+The graph is stored in CSR form as a directory of .npy files (indptr, uint16
+indices, float32 distances) plus meta.json, each row sorted by distance so any smaller
+radius is a binary-search cut. Arrays are memory-mapped on load, so every
+server process shares one copy through the page cache. Build it with:
+
+    python -m nearby_postcodes.graph [--centroid mean] [--max-radius 100]
+"""
+import argparse
+import json
+import shutil
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from .dataset import DATASET_PATH, collapse_localities, load_localities
+from .index import NeighbourGraph, PostcodeIndex
+
+GRAPH_DIR = DATASET_PATH.parent
+# Bump when the files or their encoding change; older graphs are then ignored
+GRAPH_FORMAT = 3
+DEFAULT_MAX_RADIUS_KM = 100.0
+# Postcodes per tree query while building; bounds the pair arrays held at once
+BUILD_CHUNK = 1024
+
+def graph_path(centroid="mean", root=GRAPH_DIR):
+    return Path(root) / f"neighbours_{centroid}"
+
+def build_graph(index, max_radius_km=DEFAULT_MAX_RADIUS_KM):
+    """Compute the neighbour graph of index out to max_radius_km."""
+    src, nbr, dist = [], [], []
+    for start in range(0, len(index), BUILD_CHUNK):
+        rows = np.arange(start, min(start + BUILD_CHUNK, len(index)))
+        src_pos, nbr_rows, dists = index.tree_radius_pairs(rows, max_radius_km)
+        src.append(src_pos + start)
+        nbr.append(nbr_rows.astype(np.uint16))
+        dist.append(dists.astype(np.float32))
+    return NeighbourGraph.from_pairs(
+        np.concatenate(src), np.concatenate(nbr), np.concatenate(dist), len(index), float(max_radius_km)
+    )
+
+def write_graph(graph, index, path, centroid):
+    """Write graph to the directory path, replacing any previous graph there."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "indptr.npy", graph.indptr)
+    np.save(tmp / "indices.npy", graph.indices)
+    np.save(tmp / "distances.npy", graph.distances)
+    meta = {
+        "format": GRAPH_FORMAT,
+        "centroid": centroid,
+        "max_radius_km": graph.max_radius_km,
+        "postcodes": len(index),
+        "edges": int(graph.indptr[-1]),
+        "index_fingerprint": index.fingerprint,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+
+def load_graph(path, index):
+    """Memory-map the graph at path, or return None if there is none or it was built for other data."""
+    path = Path(path)
+    meta_path = path / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    if meta.get("format") != GRAPH_FORMAT or meta.get("index_fingerprint") != index.fingerprint:
+        warnings.warn(f"{path} was built for a different dataset or format; ignoring it. Rebuild it with python -m nearby_postcodes.graph")
+        return None
+    return NeighbourGraph(
+        np.load(path / "indptr.npy", mmap_mode="r"),
+        np.load(path / "indices.npy", mmap_mode="r"),
+        np.load(path / "distances.npy", mmap_mode="r"),
+        float(meta["max_radius_km"]),
+        path=path,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m nearby_postcodes.graph", description="Precompute every postcode's neighbours within a maximum radius.")
+    parser.add_argument("--centroid", choices=("mean", "medoid", "any"), default="mean")
+    parser.add_argument("--max-radius", type=float, default=DEFAULT_MAX_RADIUS_KM, help="km (default: %(default)s)")
+    parser.add_argument("--output", help="graph directory (default: nearby_postcodes/data/neighbours_<centroid>)")
+    args = parser.parse_args()
+
+    df = collapse_localities(load_localities(), args.centroid)
+    index = PostcodeIndex(df["postal_code"].to_numpy(), df["latitude"].to_numpy(), df["longitude"].to_numpy())
+    graph = build_graph(index, args.max_radius)
+    output = args.output or graph_path(args.centroid)
+    write_graph(graph, index, output, args.centroid)
+    print(f"Wrote {int(graph.indptr[-1]):,} neighbour pairs for {len(index):,} postcodes within {args.max_radius:g} km to {output}")
+
+if __name__ == "__main__":
+    main()
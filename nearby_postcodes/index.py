@@ -0,0 +1,445 @@
+"""Great-circle geometry and the spatial index behind every neighbour query."""
+import hashlib
+import itertools
+
+import numpy as np
+
+# Same sphere as pgeocode.haversine_distance, so distances match GeoDistance exactly
+EARTH_RADIUS_KM = 6371.009
+
+# Postcodes are uint16 IDs (the 4-digit number) everywhere below the parse/format boundary.
+# Anything that isn't a 4-digit postcode encodes to INVALID_ID, which no index contains.
+INVALID_ID = np.uint16(0xFFFF)
+_POSTCODE_TEXT = np.array([f"{i:04d}" for i in range(10000)], dtype=object)
+
+def encode_postcodes(postcodes):
+    """uint16 IDs for postcode strings such as those from parse_postcodes."""
+    if isinstance(postcodes, np.ndarray) and postcodes.dtype.kind in "iu":
+        return np.where((postcodes >= 0) & (postcodes < 10000), postcodes, INVALID_ID).astype(np.uint16)
+    return np.fromiter(
+        (int(p) if len(p) <= 4 and p.isdecimal() else INVALID_ID for p in postcodes),
+        dtype=np.uint16,
+        count=len(postcodes),
+    )
+
+def format_postcodes(ids):
+    """Zero-padded postcode strings for uint16 IDs, as an object array."""
+    return _POSTCODE_TEXT[np.asarray(ids, dtype=np.intp)]
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance (km) between radian coordinates; broadcasts like any NumPy ufunc."""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    return EARTH_RADIUS_KM * (2 * np.arcsin(np.sqrt(a)))
+
+def unit_vectors(lat_deg, lon_deg):
+    """(lat, lon) in radians and the matching 3D unit vectors, the coordinates the KD-tree is built on."""
+    lat = np.ascontiguousarray(np.radians(np.asarray(lat_deg, dtype=np.float64)))
+    lon = np.ascontiguousarray(np.radians(np.asarray(lon_deg, dtype=np.float64)))
+    cos_lat = np.cos(lat)
+    return lat, lon, np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+def arc_angle(u, v):
+    """Angle (radians) between rows of unit vectors u and v, accurate at any separation."""
+    return np.arctan2(np.linalg.norm(np.cross(u, v), axis=-1), np.einsum("ij,ij->i", u, v))
+
+def point_to_arc_km(p, a, b):
+    """Great-circle km from unit vectors p[i] to the minor arc a[i]-b[i] (a point when a[i] == b[i])."""
+    n = np.cross(a, b)
+    n_len = np.linalg.norm(n, axis=-1)
+    n = n / np.where(n_len > 0, n_len, 1.0)[:, None]
+    sin_cross = np.einsum("ij,ij->i", p, n)
+    # p's foot on the arc's great circle lies between a and b when both turns agree with the normal
+    foot = p - sin_cross[:, None] * n
+    within = (
+        (n_len > 0)
+        & (np.einsum("ij,ij->i", np.cross(a, foot), n) >= 0)
+        & (np.einsum("ij,ij->i", np.cross(foot, b), n) >= 0)
+    )
+    to_ends = np.minimum(arc_angle(p, a), arc_angle(p, b))
+    cross_track = np.arcsin(np.clip(np.abs(sin_cross), 0.0, 1.0))
+    return EARTH_RADIUS_KM * np.where(within, np.minimum(cross_track, to_ends), to_ends)
+
+def chord_for_km(radius_km):
+    # Straight-line distance between unit vectors separated by radius_km of great circle
+    angle = min(radius_km / EARTH_RADIUS_KM, np.pi)
+    return 2.0 * np.sin(angle / 2.0)
+
+def expand_ranges(starts, lengths):
+    # Concatenation of arange(start, start + length) for each pair, without a Python loop
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + (np.arange(int(lengths.sum())) - offsets)
+
+def batched_searchsorted(values, starts, ends, x):
+    """searchsorted(values[starts[i]:ends[i]], x, side="right") + starts[i] for every i, in one vectorised binary search."""
+    lo = np.asarray(starts, dtype=np.intp).copy()
+    hi = np.asarray(ends, dtype=np.intp).copy()
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        go_right = active & (values[np.where(active, mid, 0)] <= x)
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+
+# float32 keeps ~7 significant digits; stored distances this close to a radius are recomputed exactly
+FLOAT32_TOLERANCE = 1e-6
+
+class NeighbourGraph:
+    """CSR neighbour lists with each row sorted by distance, answering any radius up to max_radius_km.
+
+    Rows are either postcode rows (a precomputed graph, see graph.py)
+    or positions in a batch of inputs (see cache.RadiusCache).
+    """
+
+    def __init__(self, indptr, indices, distances, max_radius_km, path=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.max_radius_km = max_radius_km
+        self.path = path  # directory it was memory-mapped from, if any
+
+    @classmethod
+    def from_pairs(cls, src, nbr_rows, dists, n_rows, max_radius_km):
+        order = np.lexsort((nbr_rows, dists, src))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n_rows))))
+        return cls(indptr, nbr_rows[order], dists[order], max_radius_km)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def row_ends(self, rows, radius_km):
+        """End offset of the neighbours within radius_km for each of rows."""
+        rows = np.asarray(rows, dtype=np.intp)
+        return batched_searchsorted(self.distances, self.indptr[rows], self.indptr[rows + 1], radius_km)
+
+    def radius_pairs(self, index, rows, radius_km):
+        """Same contract as PostcodeIndex.radius_pairs, for radius_km <= max_radius_km."""
+        rows = np.asarray(rows, dtype=np.intp)
+        starts = self.indptr[rows]
+        if self.distances.dtype != np.float32:
+            ends = self.row_ends(rows, radius_km)
+            uncertain_ends = ends
+        else:
+            # Stored distances are rounded to float32, so settle anything near the cut in float64
+            ends = self.row_ends(rows, radius_km * (1 - FLOAT32_TOLERANCE))
+            uncertain_ends = self.row_ends(rows, radius_km * (1 + FLOAT32_TOLERANCE))
+
+        lengths = uncertain_ends - starts
+        edges = expand_ranges(starts, lengths)
+        src_pos = np.repeat(np.arange(len(rows)), lengths)
+        nbr_rows = self.indices[edges].astype(np.intp)
+        dists = self.distances[edges].astype(np.float64)
+        near = edges >= np.repeat(ends, lengths)
+        if near.any():
+            dists[near] = index.pair_distances(rows[src_pos[near]], nbr_rows[near])
+            keep = dists <= radius_km
+            src_pos, nbr_rows, dists = src_pos[keep], nbr_rows[keep], dists[keep]
+
+        order = np.lexsort((nbr_rows, src_pos))
+        return src_pos[order], nbr_rows[order], dists[order]
+
+class PostcodeIndex:
+    """Postcode points as radian arrays, with a KD-tree over their 3D unit vectors.
+
+    Points may repeat a postcode (one per locality); the distance between two
+    postcodes is then the minimum over their points. When a neighbour graph is
+    attached, radii within its range are answered from the graph instead.
+    """
+
+    # Everything but the tree; enough to rebuild the index elsewhere (see parallel.py)
+    ARRAY_FIELDS = ("codes", "point_rows", "point_start", "lat", "lon", "xyz")
+
+    def __init__(self, point_codes, lat_deg, lon_deg):
+        codes, point_rows = np.unique(np.asarray(point_codes, dtype=np.uint16), return_inverse=True)
+        order = np.argsort(point_rows, kind="stable")
+        point_rows = point_rows[order]
+        lat, lon, xyz = unit_vectors(np.asarray(lat_deg)[order], np.asarray(lon_deg)[order])
+        self._setup(
+            codes=codes,
+            point_rows=point_rows,
+            point_start=np.searchsorted(point_rows, np.arange(len(codes) + 1)),
+            lat=lat,
+            lon=lon,
+            xyz=xyz,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an index from the ARRAY_FIELDS of another (e.g. memory-mapped), building only the tree."""
+        index = cls.__new__(cls)
+        index._setup(**{name: arrays[name] for name in cls.ARRAY_FIELDS})
+        return index
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAY_FIELDS}
+
+    def _setup(self, codes, point_rows, point_start, lat, lon, xyz):
+        from scipy.spatial import cKDTree  # deferred: scipy dominates the package import time
+
+        self.codes = codes
+        self.point_rows = point_rows
+        self.point_start = point_start
+        self.lat = lat
+        self.lon = lon
+        self.xyz = xyz
+        self.one_point_per_code = len(point_rows) == len(codes)
+        self.tree = cKDTree(xyz)
+        self.tree_workers = -1  # threads per tree query; process pools set this to 1
+        self.graph = None
+        # Row of every possible uint16 ID (-1 if absent), so lookups are a single gather
+        self.row_of = np.full(0x10000, -1, dtype=np.int32)
+        self.row_of[codes] = np.arange(len(codes), dtype=np.int32)
+        # Points in degrees and in longitude order, for bounding-box prefilters (see polygons.py)
+        self.lat_deg = np.degrees(lat)
+        self.lon_deg = np.degrees(lon)
+        self.lon_order = np.argsort(self.lon_deg, kind="stable")
+        self.lon_deg_sorted = self.lon_deg[self.lon_order]
+        # Shared across sessions and threads: freeze the arrays
+        for a in (self.codes, self.point_rows, self.point_start, self.lat, self.lon, self.xyz, self.row_of,
+                  self.lat_deg, self.lon_deg, self.lon_order, self.lon_deg_sorted):
+            a.setflags(write=False)
+
+        # Identifies the exact points indexed, so derived artefacts can be checked against it
+        h = hashlib.sha256()
+        for a in (self.codes, self.point_rows, self.lat, self.lon):
+            h.update(a.tobytes())
+        self.fingerprint = h.hexdigest()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, ids):
+        """Row index for each uint16 postcode ID, -1 where it is not in the dataset."""
+        return self.row_of[np.asarray(ids, dtype=np.uint16)].astype(np.intp)
+
+    def pair_distances(self, a_rows, b_rows):
+        """Exact km between postcode rows a_rows[i] and b_rows[i] (closest localities when there are several)."""
+        a_rows = np.asarray(a_rows, dtype=np.intp)
+        b_rows = np.asarray(b_rows, dtype=np.intp)
+        if self.one_point_per_code:
+            return haversine(self.lat[a_rows], self.lon[a_rows], self.lat[b_rows], self.lon[b_rows])
+        a_len = self.point_start[a_rows + 1] - self.point_start[a_rows]
+        b_len = self.point_start[b_rows + 1] - self.point_start[b_rows]
+        n = a_len * b_len
+        if len(n) == 0:
+            return np.empty(0)
+        pair = np.repeat(np.arange(len(n)), n)
+        k = expand_ranges(np.zeros(len(n), dtype=np.intp), n)
+        a_pts = self.point_start[a_rows][pair] + k // b_len[pair]
+        b_pts = self.point_start[b_rows][pair] + k % b_len[pair]
+        d = haversine(self.lat[a_pts], self.lon[a_pts], self.lat[b_pts], self.lon[b_pts])
+        return np.minimum.reduceat(d, np.cumsum(n) - n)
+
+    def radius_pairs(self, rows, radius_km):
+        """(position in rows, neighbour row, km) for every neighbour within radius_km, sorted by position then row."""
+        if self.graph is not None and radius_km <= self.graph.max_radius_km:
+            return self.graph.radius_pairs(self, rows, radius_km)
+        return self.tree_radius_pairs(rows, radius_km)
+
+    def tree_radius_pairs(self, rows, radius_km):
+        rows = np.asarray(rows, dtype=np.intp)
+        lengths = self.point_start[rows + 1] - self.point_start[rows]
+        src_pos = np.repeat(np.arange(len(rows)), lengths)
+        src_pts = expand_ranges(self.point_start[rows], lengths)
+        return self._ball_pairs(src_pos, self.lat[src_pts], self.lon[src_pts], self.xyz[src_pts], radius_km)
+
+    def coord_radius_pairs(self, lat_deg, lon_deg, radius_km):
+        """(position in the coordinates, postcode row, km) for every postcode within radius_km of each lat/lon point."""
+        lat, lon, xyz = unit_vectors(lat_deg, lon_deg)
+        return self._ball_pairs(np.arange(len(lat)), lat, lon, xyz, radius_km)
+
+    def nearest_to_coords(self, lat_deg, lon_deg):
+        """(postcode row, km) of the postcode nearest each lat/lon point."""
+        lat, lon, xyz = unit_vectors(lat_deg, lon_deg)
+        if len(lat) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        # The nearest point's postcode is the nearest postcode, also when postcodes have several points
+        _, pts = self.tree.query(xyz, k=1, workers=self.tree_workers)
+        return self.point_rows[pts].astype(np.intp), haversine(lat, lon, self.lat[pts], self.lon[pts])
+
+    def distance_to_nearest(self, rows):
+        """km from every postcode to the nearest of rows (closest localities when there are several)."""
+        from scipy.spatial import cKDTree
+
+        rows = np.asarray(rows, dtype=np.intp)
+        if len(rows) == 0:
+            return np.full(len(self.codes), np.inf)
+        lengths = self.point_start[rows + 1] - self.point_start[rows]
+        src_pts = expand_ranges(self.point_start[rows], lengths)
+        # A small tree over the inputs' points, queried once by every indexed point
+        _, nearest = cKDTree(self.xyz[src_pts]).query(self.xyz, k=1, workers=self.tree_workers)
+        nearest = src_pts[nearest]
+        km = haversine(self.lat, self.lon, self.lat[nearest], self.lon[nearest])
+        return km if self.one_point_per_code else np.minimum.reduceat(km, self.point_start[:-1])
+
+    def _ball_pairs(self, src_pos, src_lat, src_lon, src_xyz, radius_km):
+        if len(src_pos) == 0:
+            return src_pos, np.empty(0, dtype=np.intp), np.empty(0)
+
+        # Chord distance is monotonic in arc length, so the ball is exact up to float error;
+        # pad it slightly and let the haversine filter below make the final call
+        chord = chord_for_km(radius_km) * (1 + 1e-9) + 1e-12
+        candidates = self.tree.query_ball_point(src_xyz, r=chord, return_sorted=True, workers=self.tree_workers)
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.intp, count=len(candidates))
+        nbr_pts = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.intp, count=int(counts.sum()))
+        src_lat = np.repeat(src_lat, counts)
+        src_lon = np.repeat(src_lon, counts)
+        src_pos = np.repeat(src_pos, counts)
+        dists = haversine(src_lat, src_lon, self.lat[nbr_pts], self.lon[nbr_pts])
+        keep = dists <= radius_km
+        src_pos, nbr_rows, dists = src_pos[keep], self.point_rows[nbr_pts[keep]], dists[keep]
+        if self.one_point_per_code:
+            return src_pos, nbr_rows, dists
+
+        # Grouped min-reduction: keep the closest locality pair for each (input, neighbour)
+        order = np.lexsort((dists, nbr_rows, src_pos))
+        src_pos, nbr_rows, dists = src_pos[order], nbr_rows[order], dists[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (src_pos[1:] != src_pos[:-1]) | (nbr_rows[1:] != nbr_rows[:-1])
+        return src_pos[first], nbr_rows[first], dists[first]
+
+    def knn_pairs(self, rows, k, max_radius_km=None):
+        """(position in rows, neighbour row, km) for the k nearest postcodes to each of rows, sorted like radius_pairs.
+
+        Each postcode is its own nearest, at 0 km. With max_radius_km, neighbours further
+        away are dropped, so a row may get fewer than k. Ties at the k-th distance go to
+        the lower postcode.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        upper = np.inf if max_radius_km is None else chord_for_km(max_radius_km) * (1 + 1e-9) + 1e-12
+        n_points = len(self.point_rows)
+        parts = [(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0))]
+        pending = np.arange(len(rows))
+        # One point beyond k shows whether the k-th is tied; postcodes with several points may need more
+        k_pts = k + 1
+        while len(pending):
+            src_pos, nbr_rows, dists, complete = self._knn_round(rows[pending], k, min(k_pts, n_points), upper, max_radius_km)
+            done = complete[src_pos]
+            parts.append((pending[src_pos[done]], nbr_rows[done], dists[done]))
+            pending = pending[~complete]
+            k_pts *= 2
+
+        src_pos, nbr_rows, dists = (np.concatenate(a) for a in zip(*parts))
+        order = np.lexsort((nbr_rows, src_pos))
+        return src_pos[order], nbr_rows[order], dists[order]
+
+    def _knn_round(self, rows, k, k_pts, upper, max_radius_km):
+        # k nearest rows among the k_pts nearest points of each source point, and whether that is provably all of them
+        lengths = self.point_start[rows + 1] - self.point_start[rows]
+        pt_pos = np.repeat(np.arange(len(rows)), lengths)
+        src_pts = expand_ranges(self.point_start[rows], lengths)
+        _, nbr_pts = self.tree.query(self.xyz[src_pts], k=k_pts, distance_upper_bound=upper, workers=self.tree_workers)
+        nbr_pts = nbr_pts.reshape(len(src_pts), k_pts)
+        found = nbr_pts < len(self.point_rows)  # missing neighbours come back as n_points
+
+        # A row not seen is at least as far as the furthest point fetched for every source point
+        if k_pts < len(self.point_rows):
+            last = np.where(found[:, -1], nbr_pts[:, -1], 0)
+            horizon = np.where(found[:, -1], haversine(self.lat[src_pts], self.lon[src_pts], self.lat[last], self.lon[last]), np.inf)
+        else:
+            horizon = np.full(len(src_pts), np.inf)
+        pos_horizon = np.full(len(rows), np.inf)
+        np.minimum.at(pos_horizon, pt_pos, horizon)
+
+        counts = found.sum(axis=1)
+        src_pos = np.repeat(pt_pos, counts)
+        a_pts = np.repeat(src_pts, counts)
+        b_pts = nbr_pts[found]
+        dists = haversine(self.lat[a_pts], self.lon[a_pts], self.lat[b_pts], self.lon[b_pts])
+        nbr_rows = self.point_rows[b_pts]
+        if max_radius_km is not None:
+            keep = dists <= max_radius_km
+            src_pos, nbr_rows, dists = src_pos[keep], nbr_rows[keep], dists[keep]
+
+        # Closest point pair per (position, neighbour row), then the first k rows of each position by distance
+        order = np.lexsort((nbr_rows, dists, src_pos))
+        src_pos, nbr_rows, dists = src_pos[order], nbr_rows[order], dists[order]
+        if not self.one_point_per_code:
+            seen = np.zeros(len(src_pos), dtype=bool)
+            key = src_pos * len(self.codes) + nbr_rows
+            seen[np.unique(key, return_index=True)[1]] = True
+            src_pos, nbr_rows, dists = src_pos[seen], nbr_rows[seen], dists[seen]
+        rank = np.arange(len(src_pos)) - np.searchsorted(src_pos, src_pos)
+        keep = rank < k
+        src_pos, nbr_rows, dists = src_pos[keep], nbr_rows[keep], dists[keep]
+
+        # Settled when the k-th distance is strictly inside the horizon (or nothing lies beyond it)
+        has_k = np.bincount(src_pos, minlength=len(rows)) == k
+        kth = np.full(len(rows), -np.inf)
+        kth[has_k] = dists[np.searchsorted(src_pos, np.flatnonzero(has_k)) + k - 1]
+        complete = np.isinf(pos_horizon) | (has_k & (kth < pos_horizon))
+        return src_pos, nbr_rows, dists, complete
+
+    def row_unit_vectors(self, rows):
+        """A unit vector per postcode row: its point, or the normalised mean of its points."""
+        rows = np.asarray(rows, dtype=np.intp)
+        sums = np.add.reduceat(self.xyz, self.point_start[:-1])[rows]
+        return sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+    def route_rows(self, waypoints_xyz, buffer_km, max_piece_km=None):
+        """(postcode row, km to the route) for every postcode within buffer_km of the great-circle
+        polyline through waypoints_xyz (unit vectors), sorted by row.
+
+        Each leg is cut into pieces of at most max_piece_km (default 4 x buffer_km, at least 20 km)
+        and a KD-tree ball around each piece, just wide enough to hold its buffer, picks the
+        candidate points that get an exact point-to-arc distance.
+        """
+        w = np.asarray(waypoints_xyz, dtype=np.float64).reshape(-1, 3)
+        if len(w) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        if len(w) == 1:
+            w = np.vstack((w, w))
+        piece_km = max_piece_km or max(4 * buffer_km, 20.0)
+        leg_angle = arc_angle(w[:-1], w[1:])
+        pieces = np.maximum(np.ceil(leg_angle * EARTH_RADIUS_KM / piece_km).astype(np.intp), 1)
+
+        # Slerp each leg into its pieces' end points
+        leg = np.repeat(np.arange(len(leg_angle)), pieces)
+        step = expand_ranges(np.zeros(len(pieces), dtype=np.intp), pieces)
+        t0 = step / pieces[leg]
+        t1 = (step + 1) / pieces[leg]
+        a = _slerp(w[leg], w[leg + 1], leg_angle[leg], t0)
+        b = _slerp(w[leg], w[leg + 1], leg_angle[leg], t1)
+
+        # Every point within buffer_km of a piece is within half its length plus buffer_km of its middle
+        mid = a + b
+        mid_len = np.linalg.norm(mid, axis=1)
+        mid = np.where(mid_len[:, None] > 0, mid / np.where(mid_len > 0, mid_len, 1.0)[:, None], a)
+        reach = np.minimum(leg_angle[leg] / pieces[leg] / 2 + buffer_km / EARTH_RADIUS_KM, np.pi)
+        chords = 2.0 * np.sin(reach / 2.0) * (1 + 1e-9) + 1e-12
+        candidates = self.tree.query_ball_point(mid, r=chords, workers=self.tree_workers)
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.intp, count=len(candidates))
+        pts = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.intp, count=int(counts.sum()))
+        piece = np.repeat(np.arange(len(mid)), counts)
+
+        km = point_to_arc_km(self.xyz[pts], a[piece], b[piece])
+        keep = km <= buffer_km
+        rows, km = self.point_rows[pts[keep]], km[keep]
+        # Closest approach per postcode, over pieces and over its points
+        order = np.lexsort((km, rows))
+        rows, km = rows[order], km[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        return rows[first].astype(np.intp), km[first]
+
+    def polygon_rows(self, polygons):
+        """Sorted postcode rows with a point inside any of polygons (polygons.Polygon)."""
+        from .polygons import points_in_polygons
+
+        pts = points_in_polygons(self.lon_deg_sorted, self.lon_order, self.lon_deg, self.lat_deg, polygons)
+        return np.unique(self.point_rows[pts]).astype(np.intp)
+
+def _slerp(a, b, angle, t):
+    # Unit vectors a fraction t of the way along the arcs a-b (a when the arc is degenerate)
+    sin_angle = np.sin(angle)
+    safe = sin_angle > 1e-12
+    denom = np.where(safe, sin_angle, 1.0)
+    wa = np.where(safe, np.sin((1 - t) * angle) / denom, 1 - t)
+    wb = np.where(safe, np.sin(t * angle) / denom, t)
+    v = wa[:, None] * a + wb[:, None] * b
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
@@ -0,0 +1,104 @@
+"""Radius queries spread over a process pool.
+
+The parent writes the index arrays once to .npy files (in /dev/shm where it
+exists) and every worker memory-maps them, so the coordinates are shared
+rather than pickled per worker; a precomputed neighbour graph is mapped from
+its own directory the same way. Only the KD-tree is rebuilt in each worker.
+
+    with ParallelSearch(get_index(), processes=16) as search:
+        results, missing = find_neighbours_pgeocode(search, inputs, 15)
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .index import PostcodeIndex
+
+# Slices per worker, so one slow slice doesn't leave the others idle
+SLICES_PER_PROCESS = 4
+
+_worker_index = None
+
+def _init_worker(array_dir, graph_dir):
+    global _worker_index
+    arrays = {name: np.load(Path(array_dir) / f"{name}.npy", mmap_mode="r") for name in PostcodeIndex.ARRAY_FIELDS}
+    index = PostcodeIndex.from_arrays(arrays)
+    index.tree_workers = 1  # the pool already uses every core
+    if graph_dir is not None:
+        from .graph import load_graph
+
+        index.graph = load_graph(graph_dir, index)
+    _worker_index = index
+
+def _query_pairs(args):
+    method, rows, params = args
+    src_pos, nbr_rows, dists = getattr(_worker_index, method)(rows, *params)
+    # Narrow types before they are pickled back to the parent
+    return src_pos.astype(np.int32), nbr_rows.astype(np.uint16), dists
+
+class ParallelSearch:
+    """Stands in for a PostcodeIndex, answering radius_pairs and knn_pairs on a pool of worker processes."""
+
+    def __init__(self, index, processes=None):
+        self.index = index
+        self.processes = processes or os.cpu_count() or 1
+        shm = Path("/dev/shm")
+        self._array_dir = tempfile.mkdtemp(prefix="nearby_postcodes_", dir=shm if shm.is_dir() else None)
+        try:
+            for name, a in index.arrays().items():
+                np.save(Path(self._array_dir) / f"{name}.npy", a)
+            graph_dir = str(index.graph.path) if index.graph is not None and index.graph.path is not None else None
+            # spawn, not fork: the app and the API server run threads that fork would copy mid-flight
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                self.processes, initializer=_init_worker, initargs=(self._array_dir, graph_dir)
+            )
+        except BaseException:
+            # No close() will follow, so don't leave the copies behind (in /dev/shm they hold memory)
+            shutil.rmtree(self._array_dir, ignore_errors=True)
+            raise
+
+    def __getattr__(self, name):
+        # codes, lookup etc. come from the local index
+        if name == "index":
+            raise AttributeError(name)
+        return getattr(self.index, name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def radius_pairs(self, rows, radius_km):
+        """Same contract as PostcodeIndex.radius_pairs; rows are split into slices answered in parallel."""
+        return self._map("radius_pairs", rows, radius_km)
+
+    def knn_pairs(self, rows, k, max_radius_km=None):
+        """Same contract as PostcodeIndex.knn_pairs, answered in parallel like radius_pairs."""
+        return self._map("knn_pairs", rows, k, max_radius_km)
+
+    def _map(self, method, rows, *params):
+        rows = np.asarray(rows, dtype=np.intp)
+        bounds = np.linspace(0, len(rows), self.processes * SLICES_PER_PROCESS + 1).astype(np.intp)
+        slices = [(method, rows[a:b], params) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        parts = self._pool.map(_query_pairs, slices)
+        if not parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+        # Slices are in row order, so offsetting each slice's positions keeps the merged pairs in input order
+        offsets = bounds[:-1][bounds[1:] > bounds[:-1]]
+        src_pos = np.concatenate([p[0] + off for p, off in zip(parts, offsets)]).astype(np.intp)
+        nbr_rows = np.concatenate([p[1] for p in parts]).astype(np.intp)
+        dists = np.concatenate([p[2] for p in parts])
+        return src_pos, nbr_rows, dists
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        shutil.rmtree(self._array_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
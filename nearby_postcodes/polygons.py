@@ -0,0 +1,119 @@
+"""GeoJSON polygons and vectorised point-in-polygon tests for catchment queries.
+
+Coordinates stay in degrees, as GeoJSON gives them ([lon, lat] pairs), and edges
+are straight in lon/lat, which is how GeoJSON polygons are drawn on a map.
+"""
+import json
+
+import numpy as np
+
+# Point-by-edge crossing tests evaluated at once, to bound the temporary arrays
+CROSSING_BLOCK = 4_000_000
+
+class Polygon:
+    """One polygon: an exterior ring and any holes, each an (n, 2) array of lon, lat."""
+
+    def __init__(self, rings):
+        self.rings = [np.asarray(r, dtype=np.float64) for r in rings if len(r) >= 3]
+        if any(r.ndim != 2 or r.shape[1] < 2 for r in self.rings):
+            raise ValueError("polygon positions must be [lon, lat] pairs")
+        self.rings = [r[:, :2] for r in self.rings]
+        if not self.rings:
+            raise ValueError("polygon has no ring with three or more positions")
+        exterior = self.rings[0]
+        self.bbox = (exterior[:, 0].min(), exterior[:, 1].min(), exterior[:, 0].max(), exterior[:, 1].max())
+
+    def contains(self, lon, lat):
+        """Mask of the points inside (even-odd rule over every ring, so holes are excluded)."""
+        inside = np.zeros(len(lon), dtype=bool)
+        for ring in self.rings:
+            inside ^= _ring_crossings_odd(ring, lon, lat)
+        return inside
+
+def _ring_crossings_odd(ring, lon, lat):
+    # Ray cast towards +lon: odd crossings means inside. Rings may or may not repeat the first position.
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    spans = (y1 != y2)
+    x1, y1, x2, y2 = x1[spans], y1[spans], x2[spans], y2[spans]
+    slope = (x2 - x1) / (y2 - y1)
+    odd = np.zeros(len(lon), dtype=bool)
+    block = max(1, CROSSING_BLOCK // max(len(x1), 1))
+    for a in range(0, len(lon), block):
+        px = lon[a:a + block, None]
+        py = lat[a:a + block, None]
+        crosses = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1) * slope)
+        odd[a:a + block] = np.count_nonzero(crosses, axis=1) % 2 == 1
+    return odd
+
+def parse_geojson(data):
+    """(labels, lists of Polygon) from GeoJSON text or a decoded object; one entry per feature or geometry.
+
+    Features are labelled by their "name" or "id" property, else by position.
+    """
+    if isinstance(data, (str, bytes)):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"invalid GeoJSON: {exc}") from None
+    if not isinstance(data, dict):
+        raise ValueError("GeoJSON must be an object")
+
+    if data.get("type") == "FeatureCollection":
+        features = data.get("features") or []
+        if not isinstance(features, list):
+            raise ValueError("FeatureCollection features must be a list")
+    elif data.get("type") == "Feature":
+        features = [data]
+    else:
+        features = [{"type": "Feature", "geometry": data, "properties": {}}]
+
+    labels, shapes = [], []
+    for i, feature in enumerate(features, 1):
+        if not isinstance(feature, dict):
+            raise ValueError(f"feature {i} is not an object")
+        props = feature.get("properties") or {}
+        if not isinstance(props, dict):
+            raise ValueError(f"feature {i} properties are not an object")
+        polygons = _geometry_polygons(feature.get("geometry"))
+        if not polygons:
+            continue
+        labels.append(str(props.get("name") or props.get("id") or feature.get("id") or f"polygon {i}"))
+        shapes.append(polygons)
+    if not shapes:
+        raise ValueError("GeoJSON has no Polygon or MultiPolygon geometry")
+    return labels, shapes
+
+def _geometry_polygons(geometry):
+    if not isinstance(geometry, dict):
+        return []
+    kind = geometry.get("type")
+    try:
+        if kind == "Polygon":
+            return [Polygon(geometry["coordinates"])]
+        if kind == "MultiPolygon":
+            return [Polygon(rings) for rings in geometry["coordinates"]]
+    except (KeyError, TypeError, IndexError) as exc:
+        raise ValueError(f"malformed {kind} coordinates") from exc
+    if kind == "GeometryCollection":
+        geometries = geometry.get("geometries") or []
+        if not isinstance(geometries, list):
+            raise ValueError("GeometryCollection geometries must be a list")
+        return [p for g in geometries for p in _geometry_polygons(g)]
+    return []
+
+def points_in_polygons(lon_sorted, order, lon, lat, polygons):
+    """Indices of the points inside any of polygons.
+
+    lon_sorted is lon[order] ascending; each polygon's bounding box narrows the
+    points to a longitude slice and a latitude range before the ring tests.
+    """
+    hits = []
+    for polygon in polygons:
+        west, south, east, north = polygon.bbox
+        a = np.searchsorted(lon_sorted, west, side="left")
+        b = np.searchsorted(lon_sorted, east, side="right")
+        candidates = order[a:b]
+        candidates = candidates[(lat[candidates] >= south) & (lat[candidates] <= north)]
+        hits.append(candidates[polygon.contains(lon[candidates], lat[candidates])])
+    return np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.intp)
@@ -0,0 +1,332 @@
+"""Local HTTP API over the in-memory postcode index:
+
+    python -m nearby_postcodes.server [--host 127.0.0.1] [--port 8000]
+
+    GET  /health
+    GET  /neighbours?postcode=2010&radius_km=15[&centroid=mean]
+    POST /neighbours/batch    {"postcodes": [...] or "text": "...", "radius_km": 15}  -> NDJSON stream
+    POST /neighbours/flatten  {"postcodes": [...] or "text": "...", "radius_km": 15}  -> JSON
+    POST /points/batch        {"points": [{"lat": -33.87, "lon": 151.21, "id": "store 1"}, ...] or [[lat, lon], ...],
+                               "radius_km": 15}  -> NDJSON stream, with each point's nearest postcode
+
+Every neighbour query also takes k, for the k nearest postcodes instead; radius_km
+is then optional and caps their distance. The POST endpoints also take "radii", one
+per entry of "postcodes", for a radius per site; null entries use radius_km.
+
+Batch responses are streamed with chunked transfer encoding, one JSON line per
+input and a closing summary line, so the server never holds the whole result.
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .cache import find_nearest_cached, find_neighbours_cached, get_radius_cache, get_result_cache
+from .core import (
+    find_nearest_pgeocode,
+    find_neighbours_pgeocode,
+    find_postcodes_near_coords,
+    flatten_neighbour_list,
+    parse_postcodes,
+)
+from .index import format_postcodes
+
+CENTROIDS = ("mean", "medoid", "any")
+# Inputs answered per NDJSON flush
+STREAM_CHUNK = 1000
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024 * 1024
+
+class BadRequest(ValueError):
+    pass
+
+def _radius(value):
+    try:
+        radius_km = float(value)
+    except (TypeError, ValueError):
+        raise BadRequest("radius_km must be a number") from None
+    if not radius_km > 0:
+        raise BadRequest("radius_km must be positive")
+    return radius_km
+
+def _k(value):
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest("k must be an integer") from None
+    if k < 1:
+        raise BadRequest("k must be at least 1")
+    return k
+
+def _search(params):
+    # (radius_km, k, finder) for a query string or JSON body; finder(index, inputs, radii, cached) -> (result, missing),
+    # where radii is the per-input list from _inputs, or None, and cached shares whole results through the
+    # ResultCache (not for batch chunks, which nobody asks for again and would only push useful entries out)
+    if params.get("k") is None:
+        if params.get("radii") is not None and params.get("radius_km") is None:
+            return None, None, lambda index, inputs, radii, cached: find_neighbours_pgeocode(index, inputs, radii)
+        radius_km = _radius(params.get("radius_km"))
+
+        def find(index, inputs, radii, cached):
+            if radii is not None:
+                return find_neighbours_pgeocode(index, inputs, radii)
+            return (find_neighbours_cached if cached else find_neighbours_pgeocode)(index, inputs, radius_km)
+
+        return radius_km, None, find
+    if params.get("radii") is not None:
+        raise BadRequest("radii cannot be combined with k")
+    k = _k(params["k"])
+    radius_km = None if params.get("radius_km") is None else _radius(params["radius_km"])
+    return radius_km, k, lambda index, inputs, radii, cached: (
+        (find_nearest_cached if cached else find_nearest_pgeocode)(index, inputs, k, radius_km)
+    )
+
+def _centroid(value):
+    if value not in CENTROIDS:
+        raise BadRequest(f"centroid must be one of {', '.join(CENTROIDS)}")
+    return value
+
+def _postcode_entries(postcodes):
+    # Entries are postcode strings (or free text), or integer postcodes; anything else would be re-parsed as text
+    for i, p in enumerate(postcodes):
+        if isinstance(p, bool) or not isinstance(p, (str, int)):
+            raise BadRequest(f"postcodes[{i}] must be a string or an integer")
+    return [str(p) for p in postcodes]
+
+def _inputs(body, default_radius_km=None):
+    # (inputs, per-input radii or None); postcodes come as an explicit list or free text,
+    # parsed exactly like the app's text area
+    if body.get("radii") is not None:
+        postcodes, radii = body.get("postcodes"), body["radii"]
+        if not isinstance(postcodes, list) or not isinstance(radii, list) or len(radii) != len(postcodes):
+            raise BadRequest("radii must be a list as long as postcodes")
+        inputs, input_radii = [], []
+        for p, r in zip(_postcode_entries(postcodes), radii):
+            if r is None and default_radius_km is None:
+                raise BadRequest("radii has nulls but no radius_km")
+            radius_km = default_radius_km if r is None else _radius(r)
+            found = parse_postcodes(p)
+            inputs.extend(found)
+            input_radii.extend([radius_km] * len(found))
+        return inputs, input_radii
+    if "postcodes" in body:
+        postcodes = body["postcodes"]
+        if not isinstance(postcodes, list):
+            raise BadRequest("postcodes must be a list")
+        return parse_postcodes(",".join(_postcode_entries(postcodes))), None
+    if "text" in body:
+        return parse_postcodes(str(body["text"])), None
+    raise BadRequest("give either postcodes or text")
+
+def _coordinate(value):
+    # Unusable values become NaN, so the point is reported rather than failing the request
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def _points(body):
+    # (labels, latitudes, longitudes); points are labelled by their id, else their position
+    points = body.get("points")
+    if not isinstance(points, list):
+        raise BadRequest("points must be a list")
+    labels, lats, lons = [], [], []
+    for i, p in enumerate(points):
+        if isinstance(p, dict):
+            lat, lon, label = p.get("lat", p.get("latitude")), p.get("lon", p.get("longitude")), p.get("id", i)
+        elif isinstance(p, list) and len(p) == 2:
+            (lat, lon), label = p, i
+        else:
+            raise BadRequest(f"points[{i}] must be {{\"lat\", \"lon\"[, \"id\"]}} or [lat, lon]")
+        labels.append(label)
+        lats.append(_coordinate(lat))
+        lons.append(_coordinate(lon))
+    return labels, lats, lons
+
+class NeighbourHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, and chunked responses for streaming
+    server_version = "nearby-postcodes"
+    # Headers and body go out in separate writes; without this, Nagle plus delayed ACKs
+    # cap each keep-alive connection at ~25 requests per second
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path == "/health":
+                cache = get_radius_cache(self.server.default_centroid)
+                self._send_json(200, {
+                    "status": "ok",
+                    "postcodes": len(cache),
+                    "graph": cache.graph is not None,
+                    "cache": cache.stats(),
+                    "results": get_result_cache().stats(),
+                    "disk": cache.store.stats() if cache.store is not None else None,
+                })
+            elif url.path == "/neighbours":
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                self._send_json(200, self._single(query))
+            else:
+                self._send_json(404, {"error": f"no such endpoint: {url.path}"})
+        except BadRequest as exc:
+            self._send_json(400, {"error": str(exc)})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path not in ("/neighbours/batch", "/neighbours/flatten", "/points/batch"):
+                self._send_json(404, {"error": f"no such endpoint: {url.path}"})
+                return
+            body = self._read_json()
+            if url.path == "/points/batch":
+                radius_km = _radius(body.get("radius_km"))
+                labels, lats, lons = _points(body)
+                index = get_radius_cache(_centroid(body.get("centroid", self.server.default_centroid)))
+                self._stream_points(index, labels, lats, lons, radius_km)
+                return
+            radius_km, _, find = _search(body)
+            inputs, radii = _inputs(body, radius_km)
+            index = get_radius_cache(_centroid(body.get("centroid", self.server.default_centroid)))
+        except BadRequest as exc:
+            self._send_json(400, {"error": str(exc)})
+            return
+
+        if url.path == "/neighbours/batch":
+            self._stream_batch(index, inputs, radii, find)
+        else:
+            results, missing = find(index, inputs, radii, True)
+            neighbours, text = flatten_neighbour_list(results, dedupe=True, sort=True)
+            computed = len(set(inputs)) - len(missing)
+            self._send_json(200, {"neighbours": neighbours, "text": text, "missing": missing, "computed": computed})
+
+    def _single(self, query):
+        postcodes = parse_postcodes(query.get("postcode", ""))
+        if len(postcodes) != 1:
+            raise BadRequest("give exactly one postcode")
+        if "radii" in query:
+            raise BadRequest("radii is for the POST endpoints; give radius_km")
+        radius_km, k, find = _search(query)
+        index = get_radius_cache(_centroid(query.get("centroid", self.server.default_centroid)))
+        results, missing = find(index, postcodes, None, True)
+        _, rows, dists = results.input_order_pairs()
+        return {
+            "postcode": postcodes[0],
+            "radius_km": radius_km,
+            "k": k,
+            "found": not missing,
+            "neighbours": format_postcodes(index.codes[rows]).tolist(),
+            "distances_km": [round(d, 3) for d in dists.tolist()],
+        }
+
+    def _stream_batch(self, index, inputs, radii, find):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        codes = format_postcodes(index.codes)
+        missing_all = set()
+        for start in range(0, len(inputs), STREAM_CHUNK):
+            chunk = inputs[start:start + STREAM_CHUNK]
+            chunk_radii = None if radii is None else radii[start:start + STREAM_CHUNK]
+            results, missing = find(index, chunk, chunk_radii, False)
+            missing_all.update(missing)
+            lines = []
+            for p, pos in zip(chunk, results.input_pos):
+                ns = codes[results.nbr_rows[results.indptr[pos]:results.indptr[pos + 1]]].tolist() if pos >= 0 else []
+                lines.append(json.dumps({"input_postcode": p, "neighbours": ns}))
+            self._write_chunk(("\n".join(lines) + "\n").encode("utf-8"))
+        computed = len(set(inputs)) - len(missing_all)
+        self._write_chunk((json.dumps({"missing": sorted(missing_all), "computed": computed}) + "\n").encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _stream_points(self, index, labels, lats, lons, radius_km):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        codes = format_postcodes(index.codes)
+        unusable = []
+        for start in range(0, len(labels), STREAM_CHUNK):
+            stop = start + STREAM_CHUNK
+            results, missing = find_postcodes_near_coords(index, lats[start:stop], lons[start:stop], radius_km, labels[start:stop])
+            unusable.extend(missing)
+            lines = []
+            for i, pos in enumerate(results.input_pos):
+                ok = pos >= 0
+                ns = codes[results.nbr_rows[results.indptr[pos]:results.indptr[pos + 1]]].tolist() if ok else []
+                lines.append(json.dumps({
+                    "point": results.inputs[i],
+                    "nearest_postcode": codes[results.nearest_rows[i]] if ok else None,
+                    "nearest_km": round(float(results.nearest_km[i]), 3) if ok else None,
+                    "neighbours": ns,
+                }))
+            self._write_chunk(("\n".join(lines) + "\n").encode("utf-8"))
+        self._write_chunk((json.dumps({"unusable": unusable, "points": len(labels)}) + "\n").encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            # The body is left unread, so the connection can't carry another request
+            self.close_connection = True
+            if length > MAX_BODY:
+                raise BadRequest("request body too large")
+            # rfile.read(-n) would block until the client hangs up
+            raise BadRequest("Content-Length must be a non-negative integer")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as exc:
+            raise BadRequest(f"invalid JSON: {exc}") from None
+        if not isinstance(body, dict):
+            raise BadRequest("request body must be a JSON object")
+        return body
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class NeighbourServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, default_centroid="mean", verbose=False):
+        super().__init__(address, NeighbourHandler)
+        self.default_centroid = default_centroid
+        self.verbose = verbose
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m nearby_postcodes.server", description="Serve neighbour queries over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--centroid", choices=CENTROIDS, default="mean", help="default centroid mode (default: %(default)s)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    # Build the index before accepting requests, so the first caller doesn't pay for it
+    index = get_radius_cache(args.centroid)
+    server = NeighbourServer((args.host, args.port), args.centroid, args.verbose)
+    print(f"Serving {len(index):,} postcodes on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
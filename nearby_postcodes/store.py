@@ -0,0 +1,289 @@
+"""On-disk cache of neighbour lists and query results that survives restarts.
+
+One SQLite file per centroid mode and index fingerprint, so processes serving
+different datasets (e.g. during a rolling deploy) never share one; a file from an
+older format, or whose full fingerprint differs, is emptied on opening. Nothing is
+read up front: the in-memory caches (see cache.py) fall back to it on a miss, so
+a restarted process warms up from disk one lookup at a time.
+
+Writes never wait on the disk: they are queued for a background thread, which
+commits whatever has piled up in one transaction.
+"""
+import atexit
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .core import _shared_resource, get_index
+
+# Bump when the tables or their encoding change; older files are then emptied
+STORE_FORMAT = 2
+# NEARBY_POSTCODES_DISK_CACHE_DIR moves the files, or turns the disk cache off when set to "off"
+STORE_DIR = os.environ.get("NEARBY_POSTCODES_DISK_CACHE_DIR") or str(Path.home() / ".cache" / "nearby_postcodes")
+# Larger results are not persisted; past the total (NEARBY_POSTCODES_DISK_CACHE_MB) the least recently used go
+MAX_RESULT_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_RESULTS_BYTES = int(float(os.environ.get("NEARBY_POSTCODES_DISK_CACHE_MB", "512")) * 1024 * 1024)
+# Writes waiting for the writer thread; past this they are dropped rather than slowing queries down
+MAX_PENDING_WRITES = 4096
+
+def store_path(centroid, fingerprint, root=STORE_DIR):
+    return Path(root) / f"cache_{centroid}_{fingerprint[:16]}.sqlite3"
+
+@contextmanager
+def _transaction(db):
+    # The connections are in autocommit mode, so transactions are explicit
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+class DiskCache:
+    """SQLite store of per-postcode neighbour lists and whole results for one index fingerprint.
+
+    It is only a cache: if the file can't be opened or written, lookups miss and
+    writes are dropped (with one warning) rather than failing the query.
+    """
+
+    def __init__(self, path, fingerprint, max_results_bytes=DEFAULT_MAX_RESULTS_BYTES):
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.max_results_bytes = max_results_bytes
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.dropped_writes = 0
+        self._conn = None  # readers' connection, serialised by the lock
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(MAX_PENDING_WRITES)
+        self._writer = None
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # several app/API processes, and the writer, share the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS neighbours (
+                    row INTEGER PRIMARY KEY, radius_km REAL, nbr_rows BLOB, dists BLOB);
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY, arrays BLOB, info TEXT, size INTEGER, used_at REAL);
+                CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at);
+            """)
+            tag = json.dumps({"format": STORE_FORMAT, "fingerprint": self.fingerprint})
+            with _transaction(conn):
+                stored = conn.execute("SELECT value FROM meta WHERE key = 'tag'").fetchone()
+                if stored is None or stored[0] != tag:
+                    # Filled from another dataset or an older format (or never filled): start empty
+                    conn.execute("DELETE FROM neighbours")
+                    conn.execute("DELETE FROM results")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('tag', ?)", (tag,))
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('results_bytes', 0)")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _db(self):
+        # Opened on first use, not at startup
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _failed(self, exc):
+        # Called under the lock
+        if not self.errors:
+            warnings.warn(f"disk cache {self.path} unavailable ({exc}); continuing without it", stacklevel=3)
+        self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            counts = {"hits": self.hits, "misses": self.misses, "errors": self.errors,
+                      "dropped_writes": self.dropped_writes, "pending_writes": self._pending.qsize(), "path": str(self.path)}
+            try:
+                db = self._db()
+                counts["neighbour_lists"] = db.execute("SELECT COUNT(*) FROM neighbours").fetchone()[0]
+                counts["results"] = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                counts["results_bytes"] = int(db.execute("SELECT value FROM meta WHERE key = 'results_bytes'").fetchone()[0])
+            except (sqlite3.Error, OSError):
+                pass
+            return counts
+
+    def neighbours(self, rows, radius_km):
+        """{row: (radius_km, neighbour rows, km)} for the rows stored at radius_km or more, sorted by distance."""
+        rows = [int(r) for r in rows]
+        found = {}
+        with self._lock:
+            try:
+                db = self._db()
+                for a in range(0, len(rows), 500):  # stay under SQLite's bound-parameter limit
+                    batch = rows[a:a + 500]
+                    marks = ",".join("?" * len(batch))
+                    for row, radius, nbrs, dists in db.execute(
+                        f"SELECT row, radius_km, nbr_rows, dists FROM neighbours WHERE row IN ({marks}) AND radius_km >= ?",
+                        (*batch, radius_km),
+                    ):
+                        found[row] = (radius, np.frombuffer(nbrs, dtype=np.uint16), np.frombuffer(dists, dtype=np.float64))
+            except (sqlite3.Error, OSError) as exc:
+                self._failed(exc)
+            self.hits += len(found)
+            self.misses += len(rows) - len(found)
+        return found
+
+    def put_neighbours(self, rows, entries):
+        """Queue (radius_km, neighbour rows, km) per row for storing, keeping whichever radius is larger."""
+        self._queue(("neighbours", [int(r) for r in rows], list(entries)))
+
+    def result(self, key):
+        """(dict of arrays, info) stored under key, or None."""
+        with self._lock:
+            try:
+                found = self._db().execute("SELECT arrays, info FROM results WHERE key = ?", (key,)).fetchone()
+            except (sqlite3.Error, OSError) as exc:
+                self._failed(exc)
+                found = None
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._queue(("touch", key, time.time()))
+        with np.load(io.BytesIO(found[0])) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        return arrays, json.loads(found[1])
+
+    def put_result(self, key, arrays, info):
+        """Queue a dict of arrays and JSON-able info for storing under key; the least recently used go past the ceiling."""
+        self._queue(("result", key, arrays, info, time.time()))
+
+    def flush(self):
+        """Wait until every queued write has been committed (or dropped)."""
+        self._pending.join()
+
+    def clear(self):
+        self.flush()
+        with self._lock:
+            try:
+                db = self._db()
+                with _transaction(db):
+                    db.execute("DELETE FROM neighbours")
+                    db.execute("DELETE FROM results")
+                    db.execute("UPDATE meta SET value = 0 WHERE key = 'results_bytes'")
+            except (sqlite3.Error, OSError) as exc:
+                self._failed(exc)
+
+    def close(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._pending.put(None)
+            writer.join()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _queue(self, item):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="nearby-postcodes-disk-cache", daemon=True)
+                self._writer.start()
+        try:
+            self._pending.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped_writes += 1
+
+    def _write_loop(self):
+        # Each round commits everything queued meanwhile in one transaction, on the writer's own connection
+        db = None
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not None]
+            try:
+                if items:
+                    db = db or self._connect()
+                    with _transaction(db):
+                        for item in items:
+                            getattr(self, f"_write_{item[0]}")(db, *item[1:])
+                        self._evict(db)
+            except (sqlite3.Error, OSError) as exc:
+                with self._lock:
+                    self._failed(exc)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+            if len(items) < len(batch):
+                if db is not None:
+                    db.close()
+                return
+
+    def _write_neighbours(self, db, rows, entries):
+        values = [
+            (row, float(radius), np.asarray(nbrs, dtype=np.uint16).tobytes(), np.asarray(dists, dtype=np.float64).tobytes())
+            for row, (radius, nbrs, dists) in zip(rows, entries)
+        ]
+        db.executemany(
+            "INSERT INTO neighbours VALUES (?, ?, ?, ?) ON CONFLICT(row) DO UPDATE SET "
+            "radius_km = excluded.radius_km, nbr_rows = excluded.nbr_rows, dists = excluded.dists "
+            "WHERE excluded.radius_km > neighbours.radius_km",
+            values,
+        )
+
+    def _write_touch(self, db, key, used_at):
+        db.execute("UPDATE results SET used_at = ? WHERE key = ?", (used_at, key))
+
+    def _write_result(self, db, key, arrays, info, used_at):
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        blob = buf.getvalue()
+        if len(blob) > MAX_RESULT_BYTES:
+            return
+        old = db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (key, blob, json.dumps(info), len(blob), used_at))
+        grown = len(blob) - (old[0] if old else 0)
+        db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + ? WHERE key = 'results_bytes'", (grown,))
+
+    def _evict(self, db):
+        # The running total says whether anything must go; the used_at index walks only the entries that do
+        total = int(db.execute("SELECT value FROM meta WHERE key = 'results_bytes'").fetchone()[0])
+        if total <= self.max_results_bytes:
+            return
+        n = freed = 0
+        for (size,) in db.execute("SELECT size FROM results ORDER BY used_at"):
+            n += 1
+            freed += size
+            if total - freed <= self.max_results_bytes:
+                break
+        db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used_at LIMIT ?)", (n,))
+        db.execute("UPDATE meta SET value = ? WHERE key = 'results_bytes'", (total - freed,))
+
+def get_disk_cache(centroid="mean"):
+    """The process-wide DiskCache for get_index(centroid), or None when NEARBY_POSTCODES_DISK_CACHE_DIR is "off"."""
+    if STORE_DIR.lower() == "off":
+        return None
+
+    def build():
+        fingerprint = get_index(centroid).fingerprint
+        cache = DiskCache(store_path(centroid, fingerprint), fingerprint)
+        atexit.register(cache.close)  # commit queued writes, e.g. at the end of a CLI run
+        return cache
+
+    return _shared_resource(("disk_cache", centroid), build)
@@ -0,0 +1,79 @@
+"""Synthetic postcode data, indexed in every centroid mode, with brute-force distances to check searches against.
+
+The localities are clustered, so there are plenty of neighbours at small radii,
+and some are copied onto other postcodes, so equal distances (ties) occur.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from nearby_postcodes.dataset import collapse_localities
+from nearby_postcodes.index import PostcodeIndex, haversine
+
+N_POSTCODES = 300
+N_CLUSTERS = 12
+N_SHARED = 40  # localities copied onto another postcode
+
+def synthetic_localities(seed=7):
+    rng = np.random.default_rng(seed)
+    codes = np.sort(rng.choice(np.arange(800, 9999), N_POSTCODES, replace=False)).astype(np.uint16)
+    per_code = rng.integers(1, 5, N_POSTCODES)
+    postal_code = np.repeat(codes, per_code)
+    centres = np.column_stack((rng.uniform(-38, -12, N_CLUSTERS), rng.uniform(115, 153, N_CLUSTERS)))
+    centre = centres[rng.integers(0, N_CLUSTERS, len(postal_code))]
+    lat = centre[:, 0] + rng.normal(0, 0.3, len(postal_code))
+    lon = centre[:, 1] + rng.normal(0, 0.3, len(postal_code))
+    # Copy some localities onto others, so several postcodes sit at exactly the same point
+    src = rng.choice(len(lat), N_SHARED, replace=False)
+    dst = rng.choice(len(lat), N_SHARED, replace=False)
+    lat[dst], lon[dst] = lat[src], lon[src]
+    return pd.DataFrame({
+        "postal_code": postal_code,
+        "latitude": lat,
+        "longitude": lon,
+        "locality": [f"place {i}" for i in range(len(lat))],
+        "state": "NSW",
+    })
+
+@pytest.fixture(scope="session")
+def localities():
+    return synthetic_localities()
+
+@pytest.fixture(scope="session", params=["mean", "medoid", "any"])
+def index(request, localities):
+    df = collapse_localities(localities, request.param)
+    return PostcodeIndex(df["postal_code"].to_numpy(), df["latitude"].to_numpy(), df["longitude"].to_numpy())
+
+@pytest.fixture(scope="session")
+def distances(index):
+    """km between every pair of postcode rows: the closest pair of their points."""
+    lat, lon = index.lat, index.lon
+    d = haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    starts = index.point_start[:-1]
+    return np.minimum.reduceat(np.minimum.reduceat(d, starts, axis=0), starts, axis=1)
+
+def brute_radius_pairs(distances, rows, radius_km):
+    """(position, neighbour row, km) within radius_km of each of rows, sorted like PostcodeIndex.radius_pairs."""
+    src_pos, nbr_rows = np.nonzero(distances[rows] <= radius_km)
+    return src_pos, nbr_rows, distances[rows][src_pos, nbr_rows]
+
+def brute_knn_pairs(distances, rows, k, max_radius_km=None):
+    """The k nearest rows to each of rows (ties to the lower row), sorted like PostcodeIndex.knn_pairs."""
+    src, nbr = [], []
+    for pos, row in enumerate(rows):
+        d = distances[row]
+        order = np.lexsort((np.arange(len(d)), d))[:k]
+        if max_radius_km is not None:
+            order = order[d[order] <= max_radius_km]
+        order = np.sort(order)
+        src.append(np.full(len(order), pos))
+        nbr.append(order)
+    src, nbr = np.concatenate(src), np.concatenate(nbr)
+    return src, nbr, distances[np.asarray(rows)[src], nbr]
+
+def assert_same_pairs(actual, expected, rtol=0):
+    """Same pairs in the same order; distances equal, or within rtol (e.g. float32 graph distances)."""
+    src_pos, nbr_rows, dists = actual
+    np.testing.assert_array_equal(src_pos, expected[0])
+    np.testing.assert_array_equal(nbr_rows, expected[1])
+    np.testing.assert_allclose(dists, expected[2], rtol=rtol, atol=1e-9)
@@ -0,0 +1,29 @@
+"""CoverageCurve counts against a real search at each radius."""
+import numpy as np
+
+from nearby_postcodes.core import CoverageCurve, find_neighbours_pgeocode
+from nearby_postcodes.index import format_postcodes
+
+def test_counts_match_find_neighbours(index, distances):
+    rng = np.random.default_rng(3)
+    rows = rng.choice(len(index), 15, replace=False)
+    inputs = format_postcodes(index.codes[rows]).tolist() + ["0001", format_postcodes(index.codes[rows[:1]])[0]]
+    curve = CoverageCurve(index, inputs)
+    assert curve.missing == ["0001"]
+
+    # Round radii, and radii exactly at (and just below) a distance from an input, where the count steps
+    at_pairs = distances[rows][distances[rows] < 80].ravel()
+    at_pairs = rng.choice(at_pairs, 20, replace=False)
+    radii = np.concatenate(([0.0, 1.0, 5.0, 15.0, 40.0, 120.0], at_pairs, np.nextafter(at_pairs, 0)))
+    counts = curve.counts(radii)
+    for radius_km, n in zip(radii.tolist(), counts.tolist()):
+        result, missing = find_neighbours_pgeocode(index, inputs, radius_km)
+        assert missing == ["0001"]
+        assert n == curve.count(radius_km) == len(result.union_rows()), radius_km
+        assert n == np.count_nonzero((distances[rows] <= radius_km).any(axis=0))
+
+def test_missing_inputs_only(index):
+    curve = CoverageCurve(index, ["0001", "0002"])
+    assert curve.missing == ["0001", "0002"]
+    assert curve.count(500.0) == 0
+    np.testing.assert_array_equal(curve.counts([0.0, 1e6]), [0, 0])
@@ -0,0 +1,58 @@
+"""Radius queries answered from a precomputed (float32, memory-mapped) neighbour graph, against brute force."""
+import numpy as np
+import pytest
+
+from conftest import assert_same_pairs, brute_radius_pairs
+from nearby_postcodes.cache import RadiusCache
+from nearby_postcodes.graph import build_graph, load_graph, write_graph
+from nearby_postcodes.index import PostcodeIndex
+
+MAX_RADIUS_KM = 60.0
+# Distances come back as stored, rounded to float32; membership at the cut is still exact
+FLOAT32_RTOL = 1e-6
+
+@pytest.fixture(scope="module")
+def graph_index(index, tmp_path_factory):
+    # A copy of the shared index, with the graph round-tripped through disk as the app loads it
+    path = tmp_path_factory.mktemp("graph") / "neighbours"
+    write_graph(build_graph(index, MAX_RADIUS_KM), index, path, "test")
+    with_graph = PostcodeIndex.from_arrays(index.arrays())
+    with_graph.graph = load_graph(path, with_graph)
+    assert with_graph.graph is not None and with_graph.graph.distances.dtype == np.float32
+    return with_graph
+
+@pytest.mark.parametrize("radius_km", [0.0, 0.5, 5.0, 17.3, MAX_RADIUS_KM, 150.0])
+def test_graph_matches_brute_force(graph_index, distances, radius_km):
+    rows = np.arange(len(graph_index))
+    assert_same_pairs(graph_index.radius_pairs(rows, radius_km), brute_radius_pairs(distances, rows, radius_km), FLOAT32_RTOL)
+
+def test_graph_cut_exactly_at_a_pair_distance(graph_index, distances):
+    # Radii equal to (and one ulp below) real pair distances, where float32 rounding could flip the cut
+    rng = np.random.default_rng(1)
+    a, b = np.nonzero((distances > 0) & (distances < MAX_RADIUS_KM))
+    pick = rng.choice(len(a), 40, replace=False)
+    rows = np.arange(len(graph_index))
+    for d in distances[a[pick], b[pick]]:
+        for radius_km in (d, np.nextafter(d, 0)):
+            expected = brute_radius_pairs(distances, rows, radius_km)
+            assert_same_pairs(graph_index.radius_pairs(rows, radius_km), expected, FLOAT32_RTOL)
+
+def test_cache_over_graph_cuts_exactly_at_a_pair_distance(graph_index, distances):
+    # Lists cached at a wider radius hold float32 graph distances; cutting them must stay exact too
+    rng = np.random.default_rng(2)
+    warm_km = 55.0
+    a, b = np.nonzero((distances > 0) & (distances < warm_km))
+    pick = rng.choice(len(a), 40, replace=False)
+    rows = np.arange(len(graph_index))
+    cache = RadiusCache(graph_index)
+    cache.radius_pairs(rows, warm_km)
+    for d in distances[a[pick], b[pick]]:
+        for radius_km in (d, np.nextafter(d, 0)):
+            expected = brute_radius_pairs(distances, rows, radius_km)
+            assert_same_pairs(cache.radius_pairs(rows, radius_km), expected, FLOAT32_RTOL)
+    assert cache.stats()["misses"] == len(rows)
+
+def test_graph_agrees_with_the_tree(graph_index):
+    rows = np.array([5, 5, 0, len(graph_index) - 1])
+    for radius_km in (3.0, 25.0, MAX_RADIUS_KM):
+        assert_same_pairs(graph_index.radius_pairs(rows, radius_km), graph_index.tree_radius_pairs(rows, radius_km), FLOAT32_RTOL)
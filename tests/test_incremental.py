@@ -0,0 +1,64 @@
+"""IncrementalNeighbours across add/remove edits, against a fresh search and a brute-force union."""
+import numpy as np
+import pytest
+
+from nearby_postcodes.cache import IncrementalNeighbours, ResultCache, find_neighbours_cached
+from nearby_postcodes.core import find_neighbours_pgeocode, flatten_neighbour_list
+from nearby_postcodes.index import format_postcodes
+
+RADIUS_KM = 20.0
+
+def assert_same_result(actual, expected):
+    for a, b in zip(actual.input_order_pairs(), expected.input_order_pairs()):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(actual.input_pos, expected.input_pos)
+    np.testing.assert_array_equal(actual.indptr, expected.indptr)
+    np.testing.assert_array_equal(actual.union_rows(), expected.union_rows())
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_random_edits_match_a_fresh_search(index, distances, seed):
+    rng = np.random.default_rng(seed)
+    codes = format_postcodes(index.codes).tolist()
+    search = IncrementalNeighbours(index, RADIUS_KM)
+    inputs = rng.choice(codes, 60).tolist() + ["0001"]
+    for step in range(40):
+        # Drop about a tenth, add a few (repeats and unknown postcodes included)
+        inputs = [p for p in inputs if rng.random() > 0.1] + rng.choice(codes, rng.integers(0, 8)).tolist()
+        if step % 5 == 0:
+            inputs.append("0002")
+        result, missing = search.update(inputs)
+        expected, expected_missing = find_neighbours_pgeocode(index, inputs, RADIUS_KM)
+        assert missing == expected_missing
+        assert_same_result(result, expected)
+
+        rows = index.lookup(np.array([int(p) for p in inputs]))
+        rows = np.unique(rows[rows >= 0])
+        brute_union = np.flatnonzero((distances[rows] <= RADIUS_KM).any(axis=0))
+        np.testing.assert_array_equal(result.union, brute_union)
+        assert len(search) == len(rows)
+
+    # Removing everything takes every count back to zero
+    result, _ = search.update([])
+    assert len(result.union_rows()) == 0 and not search._refs.any()
+
+def test_only_added_postcodes_are_searched(index):
+    codes = format_postcodes(index.codes).tolist()
+    search = IncrementalNeighbours(index, RADIUS_KM)
+    search.update(codes[:50])
+    assert search.searched == 50
+    search.update(codes[5:55])  # five removed, five added
+    assert search.searched == 55
+    search.update(codes[5:55][::-1] + codes[5:10])  # reordered and repeated: nothing new
+    assert search.searched == 55
+
+def test_cached_finder_keeps_the_counted_union(index):
+    search = IncrementalNeighbours(index, RADIUS_KM)
+    inputs = format_postcodes(index.codes[[4, 9, 4, 30]]).tolist()
+    result, _ = find_neighbours_cached(index, inputs, RADIUS_KM, results=ResultCache(), incremental=search)
+    expected, _ = find_neighbours_pgeocode(index, inputs, RADIUS_KM)
+    assert result.union is not None
+    assert flatten_neighbour_list(result) == flatten_neighbour_list(expected)
+    # A subset may reach fewer postcodes, so it must not inherit the union
+    assert result.for_inputs(inputs[:1]).union is None
+    with pytest.raises(ValueError):
+        find_neighbours_cached(index, inputs, RADIUS_KM + 1, results=ResultCache(), incremental=search)
@@ -0,0 +1,38 @@
+"""knn_pairs against a brute-force ranking of every postcode pair."""
+import numpy as np
+import pytest
+
+from conftest import assert_same_pairs, brute_knn_pairs
+
+@pytest.mark.parametrize("k", [1, 2, 5, 17, 64])
+@pytest.mark.parametrize("max_radius_km", [None, 5.0, 40.0])
+def test_knn_matches_brute_force(index, distances, k, max_radius_km):
+    rows = np.arange(len(index))
+    expected = brute_knn_pairs(distances, rows, k, max_radius_km)
+    assert_same_pairs(index.knn_pairs(rows, k, max_radius_km), expected)
+
+def test_knn_beyond_the_whole_index(index, distances):
+    # Doubling runs out of points to fetch: every postcode comes back
+    rows = np.array([0, len(index) // 2, len(index) - 1])
+    src_pos, nbr_rows, _ = index.knn_pairs(rows, len(index) + 3)
+    np.testing.assert_array_equal(np.bincount(src_pos), [len(index)] * 3)
+    assert_same_pairs(index.knn_pairs(rows, len(index) + 3), brute_knn_pairs(distances, rows, len(index)))
+
+def test_knn_ties_go_to_the_lower_postcode(index, distances):
+    # Rows whose k-th nearest is tied with the next: the cut must keep the lower rows
+    rows, ks = [], []
+    for row in range(len(index)):
+        d = np.sort(distances[row])
+        tied = np.flatnonzero(d[1:-1] == d[2:]) + 1  # k-th equal to (k+1)-th, k >= 2
+        if len(tied):
+            rows.append(row)
+            ks.append(int(tied[0]) + 1)
+    assert rows, "synthetic data should contain tied distances"
+    for row, k in zip(rows, ks):
+        assert_same_pairs(index.knn_pairs([row], k), brute_knn_pairs(distances, [row], k))
+
+def test_knn_repeated_and_empty_rows(index, distances):
+    rows = np.array([3, 3, 10])
+    assert_same_pairs(index.knn_pairs(rows, 4), brute_knn_pairs(distances, rows, 4))
+    src_pos, nbr_rows, dists = index.knn_pairs(np.empty(0, dtype=np.intp), 4)
+    assert len(src_pos) == len(nbr_rows) == len(dists) == 0
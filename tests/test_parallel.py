@@ -0,0 +1,18 @@
+"""ParallelSearch setup and teardown of its shared array copies."""
+import glob
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from nearby_postcodes.parallel import ParallelSearch
+
+def array_dirs():
+    roots = ["/dev/shm", tempfile.gettempdir()]
+    return {p for root in roots for p in glob.glob(str(Path(root) / "nearby_postcodes_*"))}
+
+def test_failed_pool_removes_its_array_copies(index):
+    before = array_dirs()
+    with pytest.raises(ValueError):
+        ParallelSearch(index, processes=-1)
+    assert array_dirs() == before
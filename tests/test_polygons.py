@@ -0,0 +1,100 @@
+"""Polygon catchments against a pure-Python ray cast over every indexed point."""
+import json
+
+import numpy as np
+import pytest
+
+from nearby_postcodes.core import find_postcodes_in_polygons
+from nearby_postcodes.polygons import parse_geojson
+
+def ray_cast(rings, x, y):
+    # Even-odd rule over every ring, crossing edges towards +lon
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if y1 != y2 and (y1 > y) != (y2 > y) and x < x1 + (y - y1) * ((x2 - x1) / (y2 - y1)):
+                inside = not inside
+    return inside
+
+def brute_rows(index, polygons):
+    pts = [i for i, (x, y) in enumerate(zip(index.lon_deg.tolist(), index.lat_deg.tolist()))
+           if any(ray_cast(rings, x, y) for rings in polygons)]
+    return np.unique(index.point_rows[pts]).astype(np.intp)
+
+def star(lon, lat, radius_deg, n, rng):
+    # A concave polygon: points at random radii around (lon, lat)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    r = radius_deg * rng.uniform(0.3, 1.0, n)
+    return [[float(lon + r_ * np.cos(a)), float(lat + r_ * np.sin(a))] for a, r_ in zip(angles, r)]
+
+def box(west, south, east, north):
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+def features(index, rng):
+    # (name, polygons as lists of rings) around real points, so every shape holds some postcodes
+    out = []
+    for i in range(4):
+        p = rng.integers(len(index.lon_deg))
+        x, y = float(index.lon_deg[p]), float(index.lat_deg[p])
+        out.append((f"star {i}", [[star(x, y, 0.6, 12, rng)]]))
+    p, q = rng.choice(len(index.lon_deg), 2, replace=False)
+    x, y = float(index.lon_deg[p]), float(index.lat_deg[p])
+    holed = [box(x - 0.8, y - 0.8, x + 0.8, y + 0.8), box(x - 0.3, y - 0.3, x + 0.3, y + 0.3)]
+    out.append(("with hole", [holed]))
+    out.append(("multi", [holed, [star(float(index.lon_deg[q]), float(index.lat_deg[q]), 0.5, 9, rng)]]))
+    # Boxes with a real point on an edge, where the bounding-box prefilter must keep it for the ray cast
+    lon, lat = index.lon_deg.tolist(), index.lat_deg.tolist()
+    out.append(("west edge", [[box(lon[p], lat[p] - 0.7, lon[p] + 1.5, lat[p] + 0.7)]]))
+    out.append(("south edge", [[box(lon[q] - 0.7, lat[q], lon[q] + 0.7, lat[q] + 1.5)]]))
+    out.append(("north-east corner", [[box(lon[p] - 1.5, lat[p] - 1.5, lon[p], lat[p])]]))
+    return out
+
+def as_geojson(named):
+    return json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"name": name},
+         "geometry": {"type": "MultiPolygon", "coordinates": polygons}}
+        for name, polygons in named
+    ]})
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_catchments_match_a_ray_cast(index, seed):
+    named = features(index, np.random.default_rng(seed))
+    result = find_postcodes_in_polygons(index, as_geojson(named))
+    assert list(result.inputs) == [name for name, _ in named]
+    for pos, (name, polygons) in enumerate(named):
+        found = result.nbr_rows[result.indptr[pos]:result.indptr[pos + 1]]
+        np.testing.assert_array_equal(found, brute_rows(index, polygons), err_msg=name)
+
+def test_points_on_west_and_south_edges_are_inside(index):
+    # The ray cast counts them in (see ray_cast), so the prefilter must not drop them
+    p = len(index.lon_deg) // 2
+    x, y = float(index.lon_deg[p]), float(index.lat_deg[p])
+    named = [("west", [[box(x, y - 0.5, x + 1, y + 0.5)]]), ("south", [[box(x - 0.5, y, x + 0.5, y + 1)]])]
+    result = find_postcodes_in_polygons(index, as_geojson(named))
+    for pos in range(2):
+        assert index.point_rows[p] in result.nbr_rows[result.indptr[pos]:result.indptr[pos + 1]]
+
+def test_hole_excludes_its_points(index):
+    x, y = float(index.lon_deg[0]), float(index.lat_deg[0])
+    outer = box(x - 1, y - 1, x + 1, y + 1)
+    hole = box(x - 0.01, y - 0.01, x + 0.01, y + 0.01)
+    with_hole = find_postcodes_in_polygons(index, as_geojson([("a", [[outer, hole]])]))
+    without = find_postcodes_in_polygons(index, as_geojson([("a", [[outer]])]))
+    np.testing.assert_array_equal(with_hole.nbr_rows, brute_rows(index, [[outer, hole]]))
+    assert index.point_rows[0] in without.nbr_rows
+    assert set(with_hole.nbr_rows) < set(without.nbr_rows)
+
+@pytest.mark.parametrize("geojson", [
+    "not json",
+    "[]",
+    '{"type": "FeatureCollection", "features": ["x"]}',
+    '{"type": "FeatureCollection", "features": {"a": 1}}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", "properties": [1], "geometry": null}]}',
+    '{"type": "Polygon", "coordinates": [[1, 2, 3]]}',
+    '{"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1]], [[0], [1], [2]]]}',
+    '{"type": "GeometryCollection", "geometries": 5}',
+    '{"type": "Point", "coordinates": [0, 0]}',
+])
+def test_malformed_geojson_is_a_value_error(geojson):
+    with pytest.raises(ValueError):
+        parse_geojson(geojson)
@@ -0,0 +1,142 @@
+"""ResultCache eviction and coalescing, and the finders and endpoints that go through it."""
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pytest
+
+from nearby_postcodes import cache as cache_module
+from nearby_postcodes import server
+from nearby_postcodes.cache import RadiusCache, ResultCache, find_nearest_cached, find_neighbours_cached
+from nearby_postcodes.core import find_nearest_pgeocode, find_neighbours_pgeocode, flatten_neighbour_list
+from nearby_postcodes.index import format_postcodes
+
+def test_size_evicts_least_recently_used():
+    results = ResultCache(max_bytes=30, max_age_s=60)
+    for key in "abc":
+        results.get_or_compute(key, lambda: key, lambda value: 10)
+    results.get_or_compute("a", lambda: pytest.fail("a is cached"), len)  # a is now the most recent
+    results.get_or_compute("d", lambda: "d", lambda value: 10)
+    assert results.stats()["evictions"] == 1
+    assert results.get_or_compute("b", lambda: "recomputed", lambda value: 10) == "recomputed"
+    assert results.get_or_compute("a", lambda: pytest.fail("a is cached"), len) == "a"
+    # Too big to cache at all: computed every time, evicting nothing
+    calls = []
+    for _ in range(2):
+        results.get_or_compute("huge", lambda: calls.append(1), lambda value: 31)
+    assert len(calls) == 2 and results.stats()["bytes"] <= 30
+
+def test_age_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    results = ResultCache(max_bytes=100, max_age_s=10)
+    results.get_or_compute("a", lambda: 1, lambda value: 1)
+    now[0] += 10
+    assert results.get_or_compute("a", lambda: 2, lambda value: 1) == 1
+    now[0] += 0.5
+    assert results.get_or_compute("a", lambda: 3, lambda value: 1) == 3
+    assert results.stats()["entries"] == 1 and results.stats()["bytes"] == 1
+
+    # Expired entries at the old end go when something new is stored
+    results.get_or_compute("b", lambda: 1, lambda value: 1)
+    now[0] += 11
+    results.get_or_compute("c", lambda: 1, lambda value: 1)
+    assert results.stats()["entries"] == 1
+
+def concurrent_calls(results, compute, n):
+    # The leader blocks in compute until n others are waiting on it; returns (values or exceptions) per caller
+    release = threading.Event()
+    out = [None] * (n + 1)
+
+    def leader_compute():
+        release.wait(5)
+        return compute()
+
+    def call(i, fn):
+        try:
+            out[i] = results.get_or_compute("key", fn, lambda value: 1)
+        except Exception as exc:
+            out[i] = exc
+
+    threads = [threading.Thread(target=call, args=(0, leader_compute))]
+    threads[0].start()
+    while results.stats()["misses"] < 1:
+        time.sleep(0.001)
+    threads += [threading.Thread(target=call, args=(i, lambda: pytest.fail("waiter computed"))) for i in range(1, n + 1)]
+    for t in threads[1:]:
+        t.start()
+    while results.stats()["coalesced"] < n:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return out
+
+def test_concurrent_callers_share_one_computation():
+    results = ResultCache()
+    calls = []
+    value = object()
+    out = concurrent_calls(results, lambda: calls.append(1) or value, 8)
+    assert len(calls) == 1
+    assert all(v is value for v in out)
+    assert results.get_or_compute("key", lambda: pytest.fail("cached"), len) is value
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    results = ResultCache()
+
+    def fail():
+        raise KeyError("boom")
+
+    out = concurrent_calls(results, fail, 8)
+    assert all(isinstance(v, KeyError) for v in out)
+    assert results.stats()["entries"] == 0
+    assert results.get_or_compute("key", lambda: "retried", lambda value: 1) == "retried"
+
+def test_cached_finders_match_and_ignore_order(index):
+    codes = format_postcodes(index.codes[[3, 50, 3, 7]]).tolist() + ["0001"]
+    results = ResultCache()
+    for find, direct in [
+        (lambda inputs: find_neighbours_cached(index, inputs, 12.0, results), lambda inputs: find_neighbours_pgeocode(index, inputs, 12.0)),
+        (lambda inputs: find_nearest_cached(index, inputs, 4, None, results), lambda inputs: find_nearest_pgeocode(index, inputs, 4)),
+    ]:
+        for inputs in (codes, codes[::-1]):
+            result, missing = find(inputs)
+            expected, expected_missing = direct(inputs)
+            assert missing == expected_missing
+            assert flatten_neighbour_list(result) == flatten_neighbour_list(expected)
+            np.testing.assert_array_equal(result.input_pos >= 0, expected.input_pos >= 0)
+    assert results.stats()["misses"] == 2 and results.stats()["hits"] == 2
+
+@pytest.fixture
+def api(index, monkeypatch):
+    # A server over the test index, with its own caches and no disk cache
+    results = ResultCache()
+    radius_cache = RadiusCache(index)
+    monkeypatch.setattr(server, "get_radius_cache", lambda centroid: radius_cache)
+    monkeypatch.setattr(cache_module, "get_result_cache", lambda: results)
+    httpd = server.NeighbourServer(("127.0.0.1", 0))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", results
+    httpd.shutdown()
+    httpd.server_close()
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode("utf-8")
+
+def test_batch_chunks_bypass_the_result_cache(api, index):
+    url, results = api
+    inputs = format_postcodes(index.codes).tolist() * 4  # several STREAM_CHUNK chunks
+    for body in ({"postcodes": inputs, "radius_km": 10}, {"postcodes": inputs, "k": 3}):
+        lines = post(url + "/neighbours/batch", body).splitlines()
+        assert len(lines) == len(inputs) + 1
+    assert results.stats()["misses"] == 0 and results.stats()["entries"] == 0
+
+    flattened = json.loads(post(url + "/neighbours/flatten", {"postcodes": inputs[:20], "radius_km": 10}))
+    expected, _ = find_neighbours_pgeocode(index, inputs[:20], 10)
+    assert flattened["text"] == flatten_neighbour_list(expected, dedupe=True, sort=True)[1]
+    assert results.stats()["entries"] == 1
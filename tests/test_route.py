@@ -0,0 +1,104 @@
+"""Route corridors against a brute-force distance from every point to every leg."""
+import numpy as np
+import pytest
+
+from nearby_postcodes.core import find_postcodes_near_route
+from nearby_postcodes.index import EARTH_RADIUS_KM, arc_angle, format_postcodes, point_to_arc_km, unit_vectors
+
+# Legs are cut into pieces for the tree; a piece's arc can differ from its leg's in the last bits
+KM_ATOL = 1e-6
+
+def random_unit_vectors(rng, n):
+    v = rng.normal(size=(n, 3))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+def test_point_to_arc_matches_dense_sampling():
+    rng = np.random.default_rng(0)
+    n, samples = 300, 4000
+    a = random_unit_vectors(rng, n)
+    # Legs from a few km to most of a hemisphere, and some of zero length
+    b = a + random_unit_vectors(rng, n) * rng.choice([1e-3, 0.05, 0.5, 1.5], n)[:, None]
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    b[:20] = a[:20]
+    # Points near the legs, and anywhere
+    p = np.where(rng.random(n)[:, None] < 0.5, a + b + random_unit_vectors(rng, n) * 0.05, random_unit_vectors(rng, n))
+    p /= np.linalg.norm(p, axis=1, keepdims=True)
+
+    km = point_to_arc_km(p, a, b)
+    angle = arc_angle(a, b)
+    t = np.linspace(0, 1, samples)
+    for i in range(n):
+        if angle[i] == 0:
+            along = a[i][None, :]
+        else:
+            along = (np.sin((1 - t) * angle[i])[:, None] * a[i] + np.sin(t * angle[i])[:, None] * b[i]) / np.sin(angle[i])
+        sampled = EARTH_RADIUS_KM * arc_angle(np.broadcast_to(p[i], along.shape), along).min()
+        spacing = EARTH_RADIUS_KM * angle[i] / (samples - 1)
+        assert km[i] <= sampled + 1e-9
+        assert sampled - km[i] <= spacing / 2 + 1e-9
+
+def brute_route(index, xyz, buffer_km):
+    # (row, km) of every postcode within buffer_km of any leg: every point against every leg, whole
+    legs = [(xyz[0], xyz[0])] if len(xyz) == 1 else list(zip(xyz[:-1], xyz[1:]))
+    km = np.full(len(index.xyz), np.inf)
+    for a, b in legs:
+        n = len(index.xyz)
+        km = np.minimum(km, point_to_arc_km(index.xyz, np.tile(a, (n, 1)), np.tile(b, (n, 1))))
+    per_row = np.minimum.reduceat(km, index.point_start[:-1])
+    rows = np.flatnonzero(per_row <= buffer_km)
+    return rows, per_row[rows], per_row
+
+def assert_same_route(index, xyz, buffer_km, rows, km):
+    expected_rows, expected_km, every_km = brute_route(index, xyz, buffer_km)
+    # Only rows within rounding of the buffer's edge may differ
+    differ = np.setxor1d(rows, expected_rows)
+    assert np.all(np.abs(every_km[differ] - buffer_km) <= KM_ATOL)
+    common, i, j = np.intersect1d(rows, expected_rows, return_indices=True)
+    assert len(common) >= len(expected_rows) - len(differ)
+    np.testing.assert_allclose(km[i], expected_km[j], rtol=0, atol=KM_ATOL)
+
+def waypoint_vectors(index, waypoints):
+    out = []
+    for w in waypoints:
+        if isinstance(w, str):
+            out.append(index.row_unit_vectors(index.lookup(np.array([int(w)])))[0])
+        else:
+            out.append(unit_vectors([w[0]], [w[1]])[2][0])
+    return np.array(out)
+
+@pytest.mark.parametrize("buffer_km", [2.0, 15.0, 60.0])
+def test_route_rows_match_brute_force(index, buffer_km):
+    rng = np.random.default_rng(int(buffer_km))
+    for n_waypoints in (2, 3, 6):
+        xyz = index.row_unit_vectors(rng.choice(len(index), n_waypoints, replace=False))
+        rows, km = index.route_rows(xyz, buffer_km)
+        assert_same_route(index, xyz, buffer_km, rows, km)
+        # Short pieces give the same corridor
+        rows, km = index.route_rows(xyz, buffer_km, max_piece_km=3.0)
+        assert_same_route(index, xyz, buffer_km, rows, km)
+
+def test_repeated_and_single_waypoints(index):
+    codes = format_postcodes(index.codes).tolist()
+    routes = [
+        [codes[3]],  # a single waypoint: a circle around it
+        [codes[3], codes[3]],
+        [codes[3], codes[40], codes[40], codes[3]],  # a zero-length leg, and back again
+        [codes[5], (-30.0, 140.0), (-30.0, 140.0)],
+    ]
+    for waypoints in routes:
+        result, missing = find_postcodes_near_route(index, waypoints, 25.0)
+        assert missing == []
+        assert_same_route(index, waypoint_vectors(index, waypoints), 25.0, result.nbr_rows, result.dists)
+
+def test_skipped_waypoints_are_left_out(index):
+    codes = format_postcodes(index.codes).tolist()
+    swapped, nan = (151.0, -33.0), (float("nan"), 150.0)
+    waypoints = ["0001", codes[7], swapped, (-33.0, 151.0), nan, "0001", codes[90]]
+    result, missing = find_postcodes_near_route(index, waypoints, 10.0)
+    assert missing == ["0001", swapped, nan]
+    kept = [codes[7], (-33.0, 151.0), codes[90]]
+    assert_same_route(index, waypoint_vectors(index, kept), 10.0, result.nbr_rows, result.dists)
+
+    result, missing = find_postcodes_near_route(index, ["0001", swapped], 10.0)
+    assert missing == ["0001", swapped]
+    assert len(result.nbr_rows) == 0
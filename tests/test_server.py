@@ -0,0 +1,15 @@
+"""Request parsing for the HTTP API."""
+import pytest
+
+from nearby_postcodes.server import BadRequest, _inputs
+
+def test_postcodes_as_strings_text_or_integers():
+    assert _inputs({"postcodes": ["2010", 2000, "800, 2011"]}) == (["2010", "2000", "0800", "2011"], None)
+    assert _inputs({"postcodes": [2010, "3000"], "radii": [5, None]}, 10.0) == (["2010", "3000"], [5.0, 10.0])
+
+@pytest.mark.parametrize("postcodes", [[2010, None], [{"a": 1}], [["2010"]], [True], [20.1]])
+def test_other_postcode_entries_are_rejected(postcodes):
+    with pytest.raises(BadRequest, match=r"postcodes\[\d\]"):
+        _inputs({"postcodes": postcodes})
+    with pytest.raises(BadRequest, match=r"postcodes\[\d\]"):
+        _inputs({"postcodes": postcodes, "radii": [5] * len(postcodes)})
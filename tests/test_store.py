@@ -0,0 +1,39 @@
+"""DiskCache files are kept apart per dataset, and survive being reopened."""
+import numpy as np
+
+from nearby_postcodes.store import DiskCache, store_path
+
+def entry(n):
+    return (10.0, np.arange(n, dtype=np.uint16), np.linspace(0, 9, n))
+
+def test_datasets_never_share_a_file(tmp_path):
+    # As in a rolling deploy: both processes have the cache open when the old one writes
+    old = DiskCache(store_path("mean", "a" * 64, tmp_path), "a" * 64)
+    new = DiskCache(store_path("mean", "b" * 64, tmp_path), "b" * 64)
+    assert old.path != new.path
+    assert new.neighbours([3], 10.0) == {}
+    old.put_neighbours([3], [entry(4)])
+    old.put_result("key", {"x": np.arange(3)}, {"n": 3})
+    old.flush()
+    assert new.neighbours([3], 10.0) == {}
+    assert new.result("key") is None
+    assert 3 in old.neighbours([3], 10.0)
+    old.close()
+    new.close()
+
+def test_reopened_file_keeps_its_entries(tmp_path):
+    path = store_path("any", "c" * 64, tmp_path)
+    cache = DiskCache(path, "c" * 64)
+    cache.put_neighbours([1, 2], [entry(3), entry(5)])
+    cache.put_result("key", {"x": np.arange(3)}, {"n": 3})
+    cache.close()
+
+    cache = DiskCache(path, "c" * 64)
+    found = cache.neighbours([1, 2, 7], 5.0)
+    assert sorted(found) == [1, 2]
+    np.testing.assert_array_equal(found[2][1], np.arange(5))
+    arrays, info = cache.result("key")
+    np.testing.assert_array_equal(arrays["x"], np.arange(3))
+    assert info == {"n": 3}
+    assert cache.neighbours([1], 20.0) == {}  # stored at 10 km, too narrow for 20
+    cache.close()